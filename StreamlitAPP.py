@@ -8,7 +8,7 @@ import streamlit as st
 from langchain.callbacks import get_openai_callback
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'src')))
-from src.mcqgenrator.MCQGenerator import evalute_chains
+from src.mcqgenrator.MCQGenerator import evalute_chains, fit_text, llm_cache
 from src.mcqgenrator.logger import logging
 
 
@@ -31,7 +31,7 @@ with st.form("user_inputs"):
                 text = read_file(uploaded_file)
                 with get_openai_callback() as cb:
                     response = evalute_chains({
-                        "text" : text ,
+                        "text" : fit_text(text) ,
                         "number" : mcq_count,
                         "subject" : subject,
                         "tone": tone,
@@ -45,6 +45,7 @@ with st.form("user_inputs"):
                 print(f"Total prompt token :{cb.prompt_tokens}")
                 print(f"Completion Token :{cb.completion_tokens}")
                 print(f"Total cost :{cb.total_cost}")
+                llm_cache.report()
                 if isinstance(response , dict):
                     quiz = response.get("quiz" , None)
                     if quiz is not None:
@@ -1,36 +1,56 @@
 import requests
-from bs4 import BeautifulSoup
-import json
-from urllib.parse import urljoin, urlparse
-from collections import deque
-import re
-
-def is_internal_link(url, base_url):
-    """Check if the link is internal to the base URL."""
-    return urlparse(url).netloc == urlparse(base_url).netloc
-
-def is_valid_url(url):
-    """Check if the URL is valid for scraping."""
-    # Reject URLs with # or ending with certain extensions
-    invalid_extensions = ('.pdf', '.docx', '.doc', '.xlsx', '.xls', '.ppt', '.pptx', '.zip')
-    if '#' in url or url.lower().endswith(invalid_extensions):
-        return False
-    return True
-
-def scrape_content(url):
-    """Fetch and return the text content of the URL and the BeautifulSoup object."""
+import argparse
+from merge import apply_anchor_titles
+from records import RecordWriter, read_records, write_records
+from frontier import Frontier, parse_budgets
+from checkpoint import Checkpoint
+import extractor
+from extractor import extract_page
+
+# Cached parses are stored under this name and the parser's; it changes whenever parse_page returns something new
+PARSE_NAMESPACE = "a_tag/blocks"
+
+def fetch_html(url, cache=None):
+    """Fetch a URL, revalidating through the HTTP cache if one is given.
+
+    Returns the HTTP status code, the body, its content hash (``None`` without
+    a cache) and whether the server reported the cached copy as unchanged.
+    """
+    if cache is not None:
+        return cache.fetch(url)
+    response = requests.get(url)
+    return response.status_code, response.text, None, False
+
+def scrape_page(url, cache=None):
+    """Fetch and parse a URL, returning the result of parse_page or None on failure.
+
+    When the cache reports the page as unchanged, the parse stored by the
+    previous crawl is reused instead of parsing the body again.
+    """
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            content = soup.get_text(separator=" ", strip=True)
-            return content, soup
-        else:
-            print(f"Failed to retrieve {url} (status code: {response.status_code})")
-            return "", None
+        status_code, html, digest, not_modified = fetch_html(url, cache)
     except Exception as e:
         print(f"Error fetching {url}: {e}")
-        return "", None
+        return None
+    if status_code != 200:
+        print(f"Failed to retrieve {url} (status code: {status_code})")
+        return None
+    return parse_cached(html, url, digest, not_modified, cache)
+
+def parse_cached(html, url, digest, not_modified, cache):
+    """Run parse_page, reusing the cached parse when the page is unchanged."""
+    if not_modified:
+        parsed = cache.load_parsed(url, f"{PARSE_NAMESPACE}/{extractor.HTML_PARSER}", digest)
+        if parsed is not None:
+            return parsed
+    parsed = parse_page(html, url)
+    if cache is not None:
+        cache.save_parsed(url, f"{PARSE_NAMESPACE}/{extractor.HTML_PARSER}", digest, parsed)
+    return parsed
+
+def parse_page(html, url):
+    """Parse an HTML page once and return its text content, title, internal links, anchors and text blocks."""
+    return extract_page(html, url)
 
 def get_anchor_text(soup):
     """Extract the first anchor tag text or use the page title if no anchor tags are found."""
@@ -43,102 +63,176 @@ def get_anchor_text(soup):
     title = soup.title.string if soup.title and soup.title.string.strip() else 'No Title'
     return title
 
-def extract_links(soup, base_url):
-    """Extract all internal links from the page content, including from buttons."""
-    links = []
+def iter_site(url, cache=None, frontier=None, checkpoint=None, resume=False):
+    """Scrape all internal pages starting from the base URL in a single pass.
 
-    # Extract links from anchor tags
-    for a_tag in soup.find_all('a', href=True):
-        link = urljoin(base_url, a_tag['href'])  # Resolve relative URLs
-        if is_internal_link(link, base_url) and is_valid_url(link):
-            links.append(link)
-    
-    # Extract links from buttons (or elements that may redirect)
-    for button in soup.find_all(['button', 'a'], href=True):
-        if button.name == 'a':  # 'a' tag used as a button
-            link = urljoin(base_url, button['href'])
-            if is_internal_link(link, base_url) and is_valid_url(link):
-                links.append(link)
-        elif button.name == 'button':  # 'button' tag might not have href but could be used for navigation
-            onclick = button.get('onclick', '')
-            match = re.search(r"window\.location\.href\s*=\s*['\"]([^'\"]+)['\"]", onclick)
-            if match:
-                link = urljoin(base_url, match.group(1))
-                if is_internal_link(link, base_url) and is_valid_url(link):
-                    links.append(link)
-
-    # Extract links from JavaScript within the page
-    scripts = soup.find_all('script')
-    for script in scripts:
-        if script.string:
-            # Search for window.location.href or similar JS redirections
-            matches = re.findall(r"window\.location\.href\s*=\s*['\"]([^'\"]+)['\"]", script.string)
-            for match in matches:
-                link = urljoin(base_url, match)
-                if is_internal_link(link, base_url) and is_valid_url(link):
-                    links.append(link)
-
-            # Capture potential AJAX or dynamic URL loading
-            ajax_matches = re.findall(r"\$.ajax\(\{.*?url\s*:\s*['\"]([^'\"]+)['\"]", script.string, re.DOTALL)
-            for match in ajax_matches:
-                link = urljoin(base_url, match)
-                if is_internal_link(link, base_url) and is_valid_url(link):
-                    links.append(link)
-
-    # Extract links from form actions
-    for form in soup.find_all('form'):
-        action = form.get('action')
-        if action:
-            link = urljoin(base_url, action)
-            if is_internal_link(link, base_url) and is_valid_url(link):
-                links.append(link)
-
-    return list(set(links))  # Return unique internal links
-
-def scrape_website(url):
-    """Scrape all internal pages starting from the base URL."""
-    scraped_urls = set()  # Track scraped URLs to avoid duplication
-    queue = deque([url])  # Queue for BFS
-    data = []
+    Yields ``(page, anchors)`` as each page finishes: the page record of
+    ``output1`` (None if the page had no content) and the anchor records of
+    ``output2``, both taken from the same parse of the page. Pass a Frontier
+    to limit the crawl depth, page count or per-path budgets, and a
+    Checkpoint to save progress periodically (and continue it with ``resume``).
+    """
+    frontier = frontier if frontier is not None else Frontier()  # BFS queue, deduplicated on enqueue
+    if checkpoint is not None:
+        yield from checkpoint.begin(frontier, resume)
+    frontier.add(url)
     
-    while queue:
-        current_url = queue.popleft()
-        
-        if current_url in scraped_urls:
-            continue
+    while True:
+        item = frontier.pop()
+        if item is None:
+            break
+        current_url, depth = item
         
         print(f"Scraping URL: {current_url}")
         
-        # Scrape the main page content and get soup object
-        content, soup = scrape_content(current_url)
-        if content and soup:  # Only add to data if content is not empty
-            # Find the anchor text
-            anchor_text = get_anchor_text(soup)
-                
+        # Scrape and parse the page once
+        page = scrape_page(current_url, cache)
+        record, page_anchors = None, []
+        if page:
+            content, anchor_text, internal_links, page_anchors, blocks = page
+        if page and content:  # Only emit a record if content is not empty
             # Add the URL and its content along with the anchor text
-            data.append({
+            record = {
                 "url": current_url,
                 "content": content,
-                "title": anchor_text
-            })
+                "title": anchor_text,
+                "blocks": blocks  # Text blocks, for finding the site template (see boilerplate.py)
+            }
 
             # Enqueue internal links
-            internal_links = extract_links(soup, current_url)
             for link in internal_links:
-                if link not in scraped_urls:
-                    queue.append(link)
-        
-        scraped_urls.add(current_url)
+                frontier.add(link, depth + 1)
+
+        if checkpoint is not None:
+            checkpoint.record(record, page_anchors)
+            checkpoint.step(frontier)
+        yield record, page_anchors
     
+    if checkpoint is not None:
+        checkpoint.close()
+
+def crawl_site(url, cache=None, frontier=None, checkpoint=None, resume=False):
+    """Scrape the site and return all page records and all anchor records."""
+    data = []
+    anchors = []
+    for record, page_anchors in iter_site(url, cache, frontier, checkpoint, resume):
+        if record:
+            data.append(record)
+        anchors.extend(page_anchors)
+    return data, anchors
+
+def scrape_website(url, cache=None, frontier=None):
+    """Scrape all internal pages starting from the base URL."""
+    data, _ = crawl_site(url, cache, frontier)
     return data
 
-def save_to_json(data, filename="output1.json"):
-    """Save the scraped data to a JSON file."""
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=4)
+def save_to_json(data, filename="output1.jsonl"):
+    """Save the scraped data to a JSONL (or legacy JSON array) file."""
+    write_records(data, filename)
 
 if __name__ == "__main__":
-    url = "https://spo.iitk.ac.in/"  # Replace with the URL you want to scrape
-    scraped_data = scrape_website(url)
-    save_to_json(scraped_data)
-    print("Scraping complete. Data saved to output1.json.")
+    parser = argparse.ArgumentParser(description="Scrape all internal pages of a website.")
+    parser.add_argument("url", nargs="?", default="https://spo.iitk.ac.in/", help="Start URL of the crawl")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="Crawl sequentially or concurrently")
+    parser.add_argument("--concurrency", type=int, default=16, help="Maximum requests in flight (async mode)")
+    parser.add_argument("--per-host", type=int, default=4, help="Maximum requests in flight per host (async mode)")
+    parser.add_argument("--parse-workers", type=int, default=0,
+                        help="Parse pages in this many processes while fetching continues (async mode; 0 parses inline)")
+    parser.add_argument("--parse-queue", type=int, help="Fetched pages waiting for a parse worker before fetching pauses")
+    parser.add_argument("--output", help="Output file (.jsonl, or .json for a JSON array); "
+                                         "defaults to output1.jsonl unless --store is given")
+    parser.add_argument("--anchors-output", help="Also save the anchor records (as anchor.py does)")
+    parser.add_argument("--merged-output", help="Also save pages titled by their anchors (as merge.py does)")
+    parser.add_argument("--cache", help="Path of the on-disk HTTP cache (disabled if omitted)")
+    parser.add_argument("--cache-ttl", type=float, default=7, help="Days before a cached response is discarded")
+    parser.add_argument("--cache-max-mb", type=int, default=512, help="Size limit of the HTTP cache in MB")
+    parser.add_argument("--max-depth", type=int, help="Maximum link depth from the start URL")
+    parser.add_argument("--max-pages", type=int, help="Maximum number of pages to fetch")
+    parser.add_argument("--budget", action="append", metavar="PREFIX=N", help="Maximum pages under a path prefix (repeatable)")
+    parser.add_argument("--bloom-capacity", type=int, help="Track visited URLs in a Bloom filter sized for this many pages")
+    parser.add_argument("--checkpoint", default="crawl_checkpoint", help="Path prefix of the crawl checkpoint files")
+    parser.add_argument("--checkpoint-every", type=int, default=50, help="Pages between checkpoints")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint")
+    parser.add_argument("--store", help="Save pages and anchors in this page store (see page_store.py)")
+    parser.add_argument("--parser", choices=["lxml", "html.parser"], default=extractor.HTML_PARSER,
+                        help="BeautifulSoup backend; lxml is used when installed")
+    parser.add_argument("--template-blocks", action="store_true",
+                        help="Keep the text block fingerprints boilerplate.py uses to strip the site template")
+    args = parser.parse_args()
+    extractor.HTML_PARSER = args.parser
+    if args.output is None and not args.store:
+        args.output = "output1.jsonl"
+
+    frontier = Frontier(
+        max_depth=args.max_depth,
+        max_pages=args.max_pages,
+        prefix_budgets=parse_budgets(args.budget),
+        bloom_capacity=args.bloom_capacity
+    )
+    checkpoint = Checkpoint(args.checkpoint, every=args.checkpoint_every)
+
+    cache = None
+    if args.cache:
+        from http_cache import HTTPCache
+        cache = HTTPCache(args.cache, ttl=args.cache_ttl * 24 * 3600, max_bytes=args.cache_max_mb * 1024 * 1024)
+
+    store = None
+    if args.store:
+        from page_store import PageStore
+        store = PageStore(args.store)
+        store.begin_crawl()
+
+    # Records are written as pages finish instead of being held until the end
+    pages_out = RecordWriter(args.output) if args.output else None
+    anchors_out = RecordWriter(args.anchors_output) if args.anchors_output else None
+    anchor_map = {}
+
+    def save_page(record, page_anchors):
+        """Write the records of one finished page."""
+        if record and not args.template_blocks:
+            record.pop("blocks", None)
+        if record:
+            if pages_out is not None:
+                pages_out.write(record)
+            if store is not None:
+                store.put_page(record)
+        for anchor in page_anchors:
+            anchor_map[anchor["url"]] = anchor["title"]
+            if anchors_out is not None:
+                anchors_out.write(anchor)
+        if store is not None:
+            if record:  # Anchor text is page text, so pages without content have no anchors
+                store.put_anchors(record['url'], page_anchors)
+            store.commit()
+
+    if args.mode == "async":
+        from async_crawler import crawl_site_async
+        crawl_site_async(
+            args.url, concurrency=args.concurrency, per_host=args.per_host, cache=cache, frontier=frontier,
+            checkpoint=checkpoint, resume=args.resume, on_page=save_page,
+            parse_workers=args.parse_workers, parse_queue=args.parse_queue
+        )
+    else:
+        for record, page_anchors in iter_site(args.url, cache, frontier, checkpoint, args.resume):
+            save_page(record, page_anchors)
+    if cache is not None:
+        cache.report()
+        cache.close()
+    if pages_out is not None:
+        pages_out.close()
+        print(f"Scraping complete. Data saved to {args.output}.")
+    if store is not None:
+        deleted = store.end_crawl()
+        print(f"Scraping complete. Pages saved to {args.store}; {deleted} pages no longer found were removed.")
+        store.report()
+        if args.merged_output and not args.output:
+            write_records(store.pages(), args.merged_output)  # The store titles pages by their anchors itself
+            print(f"Merged data saved to {args.merged_output}.")
+        store.close()
+
+    if anchors_out is not None:
+        anchors_out.close()
+        print(f"Anchor data saved to {args.anchors_output}.")
+    if args.merged_output and args.output:
+        write_records(apply_anchor_titles(read_records(args.output), anchor_map), args.merged_output)
+        print(f"Merged data saved to {args.merged_output}.")
@@ -1,8 +1,10 @@
 import requests
 from bs4 import BeautifulSoup
-import json
 from urllib.parse import urljoin, urlparse
-from collections import deque
+import argparse
+from frontier import Frontier
+from records import write_records
+from extractor import INVALID_EXTENSIONS
 
 def is_internal_link(url, base_url):
     """Check if the link is internal to the base URL."""
@@ -11,25 +13,53 @@ def is_internal_link(url, base_url):
 def is_valid_url(url):
     """Check if the URL is valid for scraping."""
     # Reject URLs with # or ending with certain extensions
-    invalid_extensions = ('.pdf', '.docx', '.doc', '.xlsx', '.xls', '.ppt', '.pptx', '.zip')
-    if '#' in url or url.lower().endswith(invalid_extensions):
+    if '#' in url or url.lower().endswith(INVALID_EXTENSIONS):
         return False
     return True
 
-def scrape_content(url):
+def fetch_html(url, cache=None):
+    """Fetch a URL, revalidating through the HTTP cache if one is given."""
+    if cache is not None:
+        return cache.fetch(url)
+    response = requests.get(url)
+    return response.status_code, response.text, None, False
+
+def scrape_content(url, cache=None):
     """Fetch and return the BeautifulSoup object for the URL."""
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
+        status_code, html, _, _ = fetch_html(url, cache)
+        if status_code == 200:
+            soup = BeautifulSoup(html, 'html.parser')
             return soup
         else:
-            print(f"Failed to retrieve {url} (status code: {response.status_code})")
+            print(f"Failed to retrieve {url} (status code: {status_code})")
             return None
     except Exception as e:
         print(f"Error fetching {url}: {e}")
         return None
 
+def scrape_anchors(url, cache=None):
+    """Fetch a URL and return its anchor records, or None if it could not be fetched.
+
+    Pages the cache reports as unchanged reuse the anchors parsed last time.
+    """
+    try:
+        status_code, html, digest, not_modified = fetch_html(url, cache)
+    except Exception as e:
+        print(f"Error fetching {url}: {e}")
+        return None
+    if status_code != 200:
+        print(f"Failed to retrieve {url} (status code: {status_code})")
+        return None
+    if not_modified:
+        anchors = cache.load_parsed(url, "anchor", digest)
+        if anchors is not None:
+            return anchors
+    anchors = get_anchor_tags(url, BeautifulSoup(html, 'html.parser'))
+    if cache is not None:
+        cache.save_parsed(url, "anchor", digest, anchors)
+    return anchors
+
 def get_anchor_tags(url, soup):
     """Extract anchor tag names and their corresponding URLs from the page."""
     anchor_tags = []
@@ -47,46 +77,50 @@ def get_anchor_tags(url, soup):
     
     return anchor_tags
 
-def scrape_website(url):
+def scrape_website(url, cache=None, frontier=None):
     """Scrape all internal pages starting from the base URL."""
-    scraped_urls = set()  # Track scraped URLs to avoid duplication
-    queue = deque([url])  # Queue for BFS
+    frontier = frontier if frontier is not None else Frontier()  # BFS queue, deduplicated on enqueue
+    frontier.add(url)
     data = []
     
-    while queue:
-        current_url = queue.popleft()
-        
-        if current_url in scraped_urls:
-            continue
+    while True:
+        item = frontier.pop()
+        if item is None:
+            break
+        current_url, depth = item
         
         print(f"Scraping URL: {current_url}")
         
-        # Scrape the main page content and get soup object
-        soup = scrape_content(current_url)
-        if soup:  # Only add to data if content is successfully fetched
-            # Find internal links and their anchor texts
-            anchors = get_anchor_tags(current_url, soup)
-                
+        # Find internal links and their anchor texts
+        anchors = scrape_anchors(current_url, cache)
+        if anchors is not None:  # Only add to data if content is successfully fetched
             # Add the URL and its anchor tags to the data
             data.extend(anchors)
 
             # Enqueue internal links
             for anchor in anchors:
-                link = anchor["url"]
-                if link not in scraped_urls:
-                    queue.append(link)
-        
-        scraped_urls.add(current_url)
+                frontier.add(anchor["url"], depth + 1)
     
     return data
 
-def save_to_json(data, filename="output2.json"):
-    """Save the scraped data to a JSON file."""
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=4)
+def save_to_json(data, filename="output2.jsonl"):
+    """Save the scraped data to a JSONL (or legacy JSON array) file."""
+    write_records(data, filename)
 
 if __name__ == "__main__":
-    url = "https://spo.iitk.ac.in"  # Replace with the URL you want to scrape
-    scraped_data = scrape_website(url)
+    parser = argparse.ArgumentParser(description="Collect the anchor texts of all internal pages of a website.")
+    parser.add_argument("url", nargs="?", default="https://spo.iitk.ac.in", help="Start URL of the crawl")
+    parser.add_argument("--cache", help="Path of the on-disk HTTP cache (disabled if omitted)")
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache:
+        from http_cache import HTTPCache
+        cache = HTTPCache(args.cache)
+
+    scraped_data = scrape_website(args.url, cache)
+    if cache is not None:
+        cache.report()
+        cache.close()
     save_to_json(scraped_data)
-    print("Scraping complete. Data saved to output2.json.")
+    print("Scraping complete. Data saved to output2.jsonl.")
@@ -1,89 +1,140 @@
-import json
-from langchain.chains import RetrievalQA
+import re
+import time
+from itertools import islice
+import numpy as np
+from records import read_records, write_records
 from langchain.prompts import PromptTemplate
-from langchain_community.llms import CTransformers
-from langchain_community.vectorstores import Pinecone as LangchainPinecone
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from inference_server import connect_llm, PRIORITY_INTERACTIVE
+from embedding_store import EmbeddingStore
+from chunker import chunk_text, ctransformers_tokenizer
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
-os.environ['PINECONE_API_KEY'] = 'your_pinecone_api_key'
-KEY = os.getenv("PINECONE_API_KEY")
 
-# Load the JSON files
-def load_json(file_path):
-    with open(file_path, 'r') as f:
-        return json.load(f)
+CHUNK_TOKENS = 200      # Llama tokens per content chunk
+CHUNK_OVERLAP = 20
+TOP_CHUNKS = 3          # Chunks retrieved per question
+CONTEXT_CHUNKS = 6      # Retrieved chunks in one page's prompt, about 1200 tokens
+PAGE_BATCH = 32         # Pages whose chunks and questions are embedded together
 
-questions_data = load_json('generated_questions1.json')  # Contains URL and 10 questions per URL
-content_data = load_json('output1.json')  # Contains URL and corresponding content
+# Wall time per stage, reported at the end
+timings = {"load": 0.0, "chunk": 0.0, "embed": 0.0, "retrieve": 0.0, "generate": 0.0, "io": 0.0}
 
-# Initialize model and prompt
-def download_hugging_face_embedding():
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    return embeddings
+start = time.perf_counter()
 
-embeddings = download_hugging_face_embedding()
+# MiniLM embeddings persisted by content hash, so unchanged chunks and questions are never re-embedded
+embeddings = EmbeddingStore('embedding_store')
 
-# Initialize the language model
-llm = CTransformers(
-    model="C:/Users/anant/deep learning/Medical_chat_bot/model/llama-2-7b-chat.ggmlv3.q4_0.bin",
-    model_type="llama",
-    config={'max_new_tokens': 512, 'temperature': 0.8}
-)
+# Use the llama model kept warm by inference_server.py, ahead of queued question generation
+llm = connect_llm(priority=PRIORITY_INTERACTIVE)
+tokenizer = ctransformers_tokenizer(llm)
 
-# Define the prompt template
+# Index page content by URL so each lookup is a dict access instead of a scan
+content_by_url = {content['url']: content['content'] for content in read_records('output1.jsonl')}
+timings["load"] += time.perf_counter() - start
+
+# Define the prompt template: every question of a page is answered in one call
 prompt = """
-Use the following piece of information to answer the user's question 
-if you don't know the answer, say just that you don't know, don't try to make up an answer.
+Use the following pieces of information to answer the user's questions.
+If you don't know the answer to a question, say just that you don't know, don't try to make up an answer.
 
 Context: {context}
-Question: {question}
-Only return the helpful answer below and nothing else.
-Helpful answer:
+Questions:
+{questions}
+Only return the helpful answers below, numbered like the questions, one per line, and nothing else.
+Helpful answers:
 """
 
-prompt_template = PromptTemplate(template=prompt, input_variables=["context", "question"])
-chain_type_kwargs = {"prompt": prompt_template}
-
-# Create a dictionary to store the results
-result_data = []
-
-# Process each URL, questions, and content
-for item in questions_data:
-    url = item['url']
-    questions = item['questions']
-
-    # Find the corresponding content for the URL
-    content_item = next((content for content in content_data if content['url'] == url), None)
-    
-    if not content_item:
-        continue  # Skip if no corresponding content is found
-
-    content = content_item['content']
-
-    # Prepare the retrieval QA chain
-    qa = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=None,  # No external retriever needed, content is provided directly
-        return_source_documents=True,
-        chain_type_kwargs=chain_type_kwargs
-    )
-
-    # Generate answers for each question
-    answers = []
-    for question in questions:
-        query_result = qa({"query": question, "context": content})
-        answer = query_result['result']
-        answers.append({"question": question, "answer": answer})
-
-    # Store the results for this URL
-    result_data.append({"url": url, "qa_pairs": answers})
-
-# Save the results to a new JSON file
-with open('output_answers.json', 'w') as f:
-    json.dump(result_data, f, indent=4)
-
-print("Answers generated and saved to output_answers.json.")
\ No newline at end of file
+prompt_template = PromptTemplate(template=prompt, input_variables=["context", "questions"])
+
+NUMBERED = re.compile(r"^\s*(?:Q(?:uestion)?\s*)?(\d+)\s*[.):-]\s*(.*)$", re.I)
+
+def parse_answers(output, count):
+    """Split a numbered list of answers into ``count`` answers; missing ones become "I don't know"."""
+    answers = {}
+    number = None
+    for line in output.split('\n'):
+        match = NUMBERED.match(line)
+        if match and 1 <= int(match.group(1)) <= count:
+            number = int(match.group(1))
+            answers[number] = match.group(2).strip()
+        elif number is not None and line.strip():
+            answers[number] += " " + line.strip()  # Continuation of a multi-line answer
+    return [answers.get(i + 1) or "I don't know." for i in range(count)]
+
+class PageVectorStore:
+    """In-process vector store of one page's chunks, searched by cosine similarity."""
+
+    def __init__(self, chunks, vectors):
+        self.chunks = chunks
+        self.vectors = vectors
+
+    def top_chunks(self, query_vectors, k):
+        """Return, for each query, the indices of its ``k`` most similar chunks, best first."""
+        scores = query_vectors @ self.vectors.T
+        k = min(k, len(self.chunks))
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return [row[np.argsort(-scores[i, row], kind='stable')] for i, row in enumerate(best)]
+
+def answer_page(questions, chunks, chunk_rows, question_rows):
+    """Answer all of a page's questions from its most relevant chunks with a single model call."""
+    # Take the questions' best chunks round-robin until the context is full
+    t = time.perf_counter()
+    store = PageVectorStore(chunks, embeddings.matrix[chunk_rows])
+    ranked = store.top_chunks(embeddings.matrix[question_rows], TOP_CHUNKS)
+    selected = []
+    for rank in range(TOP_CHUNKS):
+        for best in ranked:
+            if rank < len(best) and best[rank] not in selected and len(selected) < CONTEXT_CHUNKS:
+                selected.append(best[rank])
+    context = "\n\n".join(chunks[i] for i in sorted(selected))  # Keep document order
+    timings["retrieve"] += time.perf_counter() - t
+
+    t = time.perf_counter()
+    numbered = "\n".join(f"{i + 1}. {question}" for i, question in enumerate(questions))
+    output = llm.invoke(prompt_template.format(context=context, questions=numbered))
+    timings["generate"] += time.perf_counter() - t
+
+    answers = parse_answers(output, len(questions))
+    return [{"question": question, "answer": answer} for question, answer in zip(questions, answers)]
+
+# Process each URL's questions against its content, embedding a batch of pages at a time
+def answer_all(questions_data):
+    # Skip pages without content or questions
+    items = (item for item in questions_data if content_by_url.get(item['url']) and item['questions'])
+    while True:
+        batch = list(islice(items, PAGE_BATCH))
+        if not batch:
+            break
+
+        t = time.perf_counter()
+        chunks = [chunk_text(content_by_url[item['url']], CHUNK_TOKENS, overlap=CHUNK_OVERLAP, tokenizer=tokenizer)
+                  for item in batch]
+        timings["chunk"] += time.perf_counter() - t
+
+        # Embed every new chunk and question of the batch together
+        t = time.perf_counter()
+        chunk_hashes = [embeddings.add(page_chunks) for page_chunks in chunks]
+        question_hashes = [embeddings.add(item['questions']) for item in batch]
+        embeddings.flush()
+        timings["embed"] += time.perf_counter() - t
+
+        for item, page_chunks, page_chunk_hashes, page_question_hashes in zip(batch, chunks, chunk_hashes, question_hashes):
+            # Store the results for this URL
+            yield {"url": item['url'], "qa_pairs": answer_page(item['questions'], page_chunks,
+                                                               embeddings.rows(page_chunk_hashes),
+                                                               embeddings.rows(page_question_hashes))}
+
+questions_data = read_records('generated_questions1.jsonl')  # Contains URL and 10 questions per URL
+
+# Save the results to a new JSON file as they are produced
+t = time.perf_counter()
+pages = write_records(answer_all(questions_data), 'output_answers.json')
+timings["io"] = time.perf_counter() - t - sum(timings[stage] for stage in ("chunk", "embed", "retrieve", "generate"))
+embeddings.save()
+embeddings.report()
+
+print(f"Answered questions for {pages} pages")
+for stage, seconds in timings.items():
+    print(f"  {stage:<9} {seconds:8.2f}s")
+print("Answers generated and saved to output_answers.json.")
@@ -0,0 +1,240 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+import httpx
+
+import extractor
+from a_tag import parse_cached, PARSE_NAMESPACE
+from frontier import Frontier
+
+async def fetch_page(client, url, host_limits, cache=None):
+    """Fetch and parse a URL through the shared client, or return None on failure."""
+    fetched = await fetch_html(client, url, host_limits, cache)
+    if fetched is None:
+        return None
+    return parse_cached(*fetched, cache)
+
+async def fetch_html(client, url, host_limits, cache=None):
+    """Fetch a URL through the shared client; return ``(html, url, digest, not_modified)`` or None on failure."""
+    headers = cache.conditional_headers(url) if cache is not None else {}
+    async with host_limits[urlparse(url).netloc]:
+        try:
+            response = await client.get(url, headers=headers)
+        except Exception as e:
+            print(f"Error fetching {url}: {e}")
+            return None
+    if cache is not None:
+        status_code, html, digest, not_modified = cache.record_response(
+            url, response.status_code, response.text, response.headers
+        )
+    else:
+        status_code, html, digest, not_modified = response.status_code, response.text, None, False
+    if status_code != 200:
+        print(f"Failed to retrieve {url} (status code: {status_code})")
+        return None
+    return html, url, digest, not_modified
+
+async def crawl(url, concurrency=16, per_host=4, timeout=30.0, cache=None, frontier=None, checkpoint=None, resume=False,
+                on_page=None, parse_workers=0, parse_queue=None):
+    """Crawl all internal pages starting from the base URL with concurrent workers.
+
+    ``concurrency`` bounds the number of requests in flight overall and
+    ``per_host`` bounds them for any single host. Connections are pooled and
+    kept alive across requests. The Frontier deduplicates URLs and applies
+    the crawl budgets and an optional Checkpoint saves progress periodically.
+
+    With ``parse_workers``, pages are parsed in a pool of that many
+    processes instead of on the event loop, so parsing uses every core while
+    the fetches continue. Fetched pages wait for a parser in a queue of
+    ``parse_queue`` pages (four per parse worker by default); when it is
+    full, fetching pauses until the parsers catch up.
+
+    With ``on_page``, ``on_page(page, anchors)`` is called as each page
+    finishes and nothing is kept in memory. Otherwise the page records and
+    anchor records are returned, both in page discovery order so output is
+    stable between runs.
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(per_host))
+    frontier = frontier if frontier is not None else Frontier()
+    restored_data, restored_anchors = [], []
+    if checkpoint is not None:
+        for record, page_anchors in checkpoint.begin(frontier, resume):
+            if on_page is not None:
+                on_page(record, page_anchors)
+            else:
+                if record:
+                    restored_data.append(record)
+                restored_anchors.extend(page_anchors)
+    frontier.add(url)
+    queue = asyncio.Queue()
+    discovered = {}  # URL -> discovery order
+    scheduled = {}  # URL -> (url, depth) handed out by the frontier but not finished yet
+    results = {}
+    anchors = {}
+
+    def schedule():
+        """Move URLs the frontier hands out onto the worker queue."""
+        while True:
+            item = frontier.pop()
+            if item is None:
+                break
+            discovered[item[0]] = len(discovered)
+            scheduled[item[0]] = item
+            queue.put_nowait(item)
+
+    schedule()
+
+    def finish(current_url, depth, page):
+        """Record a page's results, enqueue its links and mark it done."""
+        try:
+            if page:
+                content, title, links, page_anchors, blocks = page
+                anchors[current_url] = page_anchors
+                if content:  # Only add to data if content is not empty
+                    results[current_url] = {
+                        "url": current_url,
+                        "content": content,
+                        "title": title,
+                        "blocks": blocks
+                    }
+                    for link in links:
+                        frontier.add(link, depth + 1)
+                    schedule()
+        except Exception as e:
+            print(f"Error parsing {current_url}: {e}")
+        finally:
+            del scheduled[current_url]
+            if checkpoint is not None:
+                checkpoint.record(results.get(current_url), anchors.get(current_url, []))
+                checkpoint.step(frontier, pending=list(scheduled.values()))
+            if on_page is not None:
+                on_page(results.pop(current_url, None), anchors.pop(current_url, []))
+            queue.task_done()
+
+    pool = ProcessPoolExecutor(parse_workers) if parse_workers else None
+    html_queue = asyncio.Queue(maxsize=parse_queue or 4 * parse_workers)  # Fetched pages waiting for a parser
+    loop = asyncio.get_running_loop()
+    namespace = f"{PARSE_NAMESPACE}/{extractor.HTML_PARSER}"
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True) as client:
+        async def worker():
+            while True:
+                current_url, depth = await queue.get()
+                page = None
+                try:
+                    print(f"Scraping URL: {current_url}")
+                    if pool is None:
+                        page = await fetch_page(client, current_url, host_limits, cache)
+                    else:
+                        fetched = await fetch_html(client, current_url, host_limits, cache)
+                        if fetched is not None:
+                            html, _, digest, not_modified = fetched
+                            page = cache.load_parsed(current_url, namespace, digest) if not_modified else None
+                            if page is None:
+                                # The parser finishes the page; waits here while the parse queue is full
+                                await html_queue.put((current_url, depth, html, digest))
+                                continue
+                except Exception as e:
+                    print(f"Error parsing {current_url}: {e}")
+                finish(current_url, depth, page)
+
+        async def parser():
+            while True:
+                current_url, depth, html, digest = await html_queue.get()
+                page = None
+                try:
+                    page = await loop.run_in_executor(pool, extractor.extract_page, html, current_url,
+                                                      extractor.HTML_PARSER)
+                    if cache is not None:
+                        cache.save_parsed(current_url, namespace, digest, page)
+                except Exception as e:
+                    print(f"Error parsing {current_url}: {e}")
+                finish(current_url, depth, page)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        if pool is not None:
+            # Enough feeders to keep every process busy while results are handled on the loop
+            workers += [asyncio.create_task(parser()) for _ in range(2 * parse_workers)]
+        await queue.join()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    if pool is not None:
+        pool.shutdown()
+
+    if checkpoint is not None:
+        checkpoint.close()
+    data = restored_data + [results[page_url] for page_url in sorted(results, key=discovered.get)]
+    anchor_data = restored_anchors + [
+        anchor for page_url in sorted(anchors, key=discovered.get) for anchor in anchors[page_url]
+    ]
+    return data, anchor_data
+
+def crawl_site_async(url, concurrency=16, per_host=4, timeout=30.0, cache=None, frontier=None, checkpoint=None, resume=False,
+                     on_page=None, parse_workers=0, parse_queue=None):
+    """Crawl the site with the async engine and return page and anchor records."""
+    return asyncio.run(crawl(
+        url, concurrency=concurrency, per_host=per_host, timeout=timeout, cache=cache, frontier=frontier,
+        checkpoint=checkpoint, resume=resume, on_page=on_page, parse_workers=parse_workers, parse_queue=parse_queue
+    ))
+
+def scrape_website_async(url, concurrency=16, per_host=4, timeout=30.0, cache=None, frontier=None):
+    """Scrape all internal pages starting from the base URL using the async engine."""
+    data, _ = crawl_site_async(url, concurrency=concurrency, per_host=per_host, timeout=timeout, cache=cache, frontier=frontier)
+    return data
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import threading
+    import time
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    parser = argparse.ArgumentParser(description="Benchmark parse workers by crawling a local fixture site.")
+    parser.add_argument("--pages", type=int, default=400, help="Pages on the fixture site")
+    parser.add_argument("--page-kb", type=int, default=200, help="Approximate size of each page")
+    parser.add_argument("--workers", type=int, nargs="*", help="Parse worker counts to compare (default: 1, 2, 4, ... cores)")
+    args = parser.parse_args()
+
+    # Large pages with a template, nested markup and links to the next pages, served from memory
+    paragraph = "<div class='item'><p>Placement drive <b>details</b> and <a href='/page/{}'>notice</a> text.</p></div>"
+    repeat = args.page_kb * 1024 // len(paragraph)
+    site = {}
+    for i in range(args.pages):
+        body = "".join(paragraph.format((i + j) % args.pages) for j in range(1, repeat + 1))
+        site[f"/page/{i}"] = (f"<html><head><title>Page {i}</title></head><body><nav><a href='/page/0'>Home</a></nav>"
+                              f"<main>{body}</main><footer>Footer</footer></body></html>").encode('utf-8')
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = site.get(self.path)
+            self.send_response(200 if body else 404)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    start_url = f"http://127.0.0.1:{server.server_address[1]}/page/0"
+
+    cores = os.cpu_count() or 1
+    counts = args.workers or sorted({1 << i for i in range(cores.bit_length())} | {cores})
+    print(f"Fixture site: {args.pages} pages of ~{args.page_kb} KB, {cores} cores")
+    baseline = None
+    for parse_workers in [0] + counts:
+        pages = []
+        start = time.perf_counter()
+        crawl_site_async(start_url, concurrency=16, per_host=16, parse_workers=parse_workers,
+                         on_page=lambda page, anchors: pages.append(page))
+        rate = len(pages) / (time.perf_counter() - start)
+        baseline = baseline or rate
+        label = "inline parsing" if parse_workers == 0 else f"{parse_workers} parse workers"
+        print(f"{label:18s} {rate:8.1f} pages/sec  ({rate / baseline:.2f}x)")
+    server.shutdown()
@@ -0,0 +1,128 @@
+import argparse
+import hashlib
+from collections import Counter
+from urllib.parse import urlsplit
+
+from records import read_records, write_records
+from chunker import tiktoken_tokenizer
+
+# Elements that start a new block of text; inline elements (a, span, b, ...) belong to the enclosing block
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "body", "dd", "details", "dialog", "div", "dl", "dt",
+    "fieldset", "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header",
+    "hgroup", "li", "main", "nav", "ol", "p", "pre", "section", "summary", "table", "td", "th", "tr", "ul",
+}
+
+def block_fingerprint(block, text):
+    """Hash a block's position in the DOM (its tag path and classes) together with its text."""
+    path = []
+    elements = [block, *block.parents] if block is not None else []
+    for element in elements:
+        if element.name != "[document]":
+            path.append(element.name + "." + ".".join(element.get("class", [])))
+    return hashlib.sha1((">".join(reversed(path)) + "\0" + text).encode('utf-8')).hexdigest()[:16]
+
+def page_blocks(soup):
+    """Split a page's text into blocks and return ``[fingerprint, length]`` for each.
+
+    A block is a run of consecutive strings under the same block-level
+    element. Lengths are in characters of
+    ``soup.get_text(separator=" ", strip=True)``, which is exactly the
+    blocks' texts joined by single spaces.
+    """
+    blocks = []
+    current, parts = None, []
+    for string in soup.strings:
+        text = string.strip()
+        if not text:
+            continue
+        block = next((parent for parent in string.parents if parent.name in BLOCK_TAGS), None)
+        if parts and block is not current:
+            joined = " ".join(parts)
+            blocks.append([block_fingerprint(current, joined), len(joined)])
+            parts = []
+        current = block
+        parts.append(text)
+    if parts:
+        joined = " ".join(parts)
+        blocks.append([block_fingerprint(current, joined), len(joined)])
+    return blocks
+
+def strip_blocks(content, blocks, template):
+    """Return the content without the blocks whose fingerprints are in ``template``.
+
+    The content is returned unchanged if the blocks do not describe it.
+    """
+    if sum(length for _, length in blocks) + len(blocks) - 1 != len(content):
+        return content
+    kept, position = [], 0
+    for fingerprint, length in blocks:
+        if fingerprint not in template:
+            kept.append(content[position:position + length])
+        position += length + 1
+    return " ".join(kept)
+
+def find_templates(records, min_fraction=0.5, min_pages=3):
+    """Count block fingerprints over the crawl and return the template blocks of each host.
+
+    A block is part of the site template when it appears on at least
+    ``min_fraction`` of a host's pages, and on at least ``min_pages``.
+    """
+    pages = Counter()
+    counts = Counter()
+    for record in records:
+        host = urlsplit(record['url']).netloc
+        pages[host] += 1
+        counts.update((host, fingerprint) for fingerprint in {fingerprint for fingerprint, _ in record.get('blocks', [])})
+    templates = {}
+    for (host, fingerprint), count in counts.items():
+        if count >= max(min_pages, min_fraction * pages[host]):
+            templates.setdefault(host, set()).add(fingerprint)
+    return templates
+
+def strip_templates(records, templates, stats, tokenizer=None):
+    """Yield the records with their template blocks removed and the ``blocks`` field dropped.
+
+    Pages made of nothing but template blocks keep their text.
+    """
+    for record in records:
+        blocks = record.pop('blocks', [])
+        stripped = strip_blocks(record['content'], blocks, templates.get(urlsplit(record['url']).netloc, ()))
+        stats["pages"] += 1
+        if stripped and stripped != record['content']:
+            stats["stripped"] += 1
+            stats["chars_saved"] += len(record['content']) - len(stripped)
+            if tokenizer is not None:
+                stats["tokens_saved"] += len(tokenizer.encode(record['content'])) - len(tokenizer.encode(stripped))
+            record['content'] = stripped
+        yield record
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Strip the blocks repeated on most pages of a site (menus, headers, footers).")
+    parser.add_argument("--input", default="output1.jsonl", help="Page records crawled with --template-blocks")
+    parser.add_argument("--output", default="output1_stripped.jsonl", help="Page records without the template text")
+    parser.add_argument("--min-fraction", type=float, default=0.5, help="Share of a host's pages a template block appears on")
+    parser.add_argument("--min-pages", type=int, default=3, help="Fewest pages a template block appears on")
+    parser.add_argument("--store", help="Cut the template from the pages of this page store in place instead of files")
+    args = parser.parse_args()
+
+    # Two streaming passes: count the blocks of every page, then cut the template ones
+    stats = Counter()
+    if args.store:
+        from page_store import PageStore
+        store = PageStore(args.store)
+        templates = find_templates(store.pages_with_blocks(), args.min_fraction, args.min_pages)
+        stripped = strip_templates(store.pages_with_blocks(), templates, stats, tiktoken_tokenizer("gpt-3.5-turbo"))
+        for record in stripped:
+            store.put_content(record['url'], record['content'])
+        store.close()
+    else:
+        templates = find_templates(read_records(args.input), args.min_fraction, args.min_pages)
+        write_records(strip_templates(read_records(args.input), templates, stats, tiktoken_tokenizer("gpt-3.5-turbo")),
+                      args.output)
+
+    pages = max(stats["pages"], 1)
+    print(f"{sum(len(blocks) for blocks in templates.values())} template blocks on {len(templates)} hosts; "
+          f"stripped from {stats['stripped']} of {stats['pages']} pages")
+    print(f"Average saved per page: {stats['tokens_saved'] / pages:.0f} tokens ({stats['chars_saved'] / pages:.0f} characters)")
+    print(f"Pages without template text saved to {args.store or args.output}")
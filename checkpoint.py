@@ -0,0 +1,86 @@
+import json
+import os
+
+from records import read_records
+
+def write_atomic(path, text):
+    """Write a file so that readers see either the old or the new contents, never a partial write."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class Checkpoint:
+    """Periodically saves crawl progress so an interrupted crawl can resume.
+
+    Page and anchor records are appended to ``<path>.records.jsonl`` as each
+    page finishes. Every ``every`` pages the frontier state and the length of
+    the records file are written atomically to ``<path>.json``; on resume the
+    records file is truncated back to that length, so a crash between two
+    checkpoints only repeats the pages fetched since the last one.
+    """
+
+    def __init__(self, path="crawl_checkpoint", every=50):
+        self.state_path = f"{path}.json"
+        self.records_path = f"{path}.records.jsonl"
+        self.every = every
+        self.since_save = 0
+        self.records = None
+
+    def begin(self, frontier, resume=False):
+        """Start checkpointing, restoring the last checkpoint into the frontier when resuming.
+
+        Returns an iterator over the (page, anchors) records emitted before
+        the checkpoint, which must be consumed before crawling continues.
+        """
+        if resume and os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            size = os.path.getsize(self.records_path) if os.path.exists(self.records_path) else 0
+            if state["records_offset"] > size:
+                raise ValueError(f"{self.state_path} points past the end of {self.records_path} "
+                                 f"({state['records_offset']} > {size} bytes); start the crawl again without --resume")
+            frontier.restore(state["frontier"])
+            with open(self.records_path, 'a') as f:
+                f.truncate(state["records_offset"])
+            print(f"Resuming crawl from {self.state_path} ({frontier.popped} pages already crawled)")
+            self.records = open(self.records_path, 'a')
+            return self._restored_records()
+        # A previous crawl's state must not be resumed over this crawl's records
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self.records = open(self.records_path, 'w')
+        return iter(())
+
+    def _restored_records(self):
+        """Yield the (page, anchors) records kept in the checkpoint."""
+        for entry in read_records(self.records_path):
+            yield entry["page"], entry["anchors"]
+
+    def record(self, page, anchors):
+        """Append the records produced by one finished page (``page`` may be None)."""
+        self.records.write(json.dumps({"page": page, "anchors": anchors}) + "\n")
+
+    def step(self, frontier, pending=()):
+        """Count a finished page and save a checkpoint every ``every`` pages."""
+        self.since_save += 1
+        if self.since_save >= self.every:
+            self.save(frontier, pending)
+
+    def save(self, frontier, pending=()):
+        """Flush the records and atomically write the frontier state."""
+        self.records.flush()
+        os.fsync(self.records.fileno())
+        state = {"frontier": frontier.state(pending), "records_offset": self.records.tell()}
+        write_atomic(self.state_path, json.dumps(state))
+        self.since_save = 0
+
+    def close(self, completed=True):
+        """Stop checkpointing; a completed crawl removes its checkpoint files."""
+        self.records.close()
+        if completed:
+            for path in (self.state_path, self.records_path):
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,159 @@
+import argparse
+import re
+import time
+from collections import deque, namedtuple
+
+# encode(text) -> list of tokens, decode(tokens) -> text
+Tokenizer = namedtuple("Tokenizer", ["encode", "decode"])
+
+# Whitespace-separated words, each keeping its trailing whitespace so decoding is exact
+WORDS = Tokenizer(re.compile(r"\S+\s*").findall, "".join)
+
+# Pieces of at most 4 word characters or one symbol: a conservative stand-in for BPE tokens
+APPROX = Tokenizer(re.compile(r"\s*(?:\w{1,4}|[^\w\s])").findall, "".join)
+
+# A sentence, or a line when the text has line breaks, with its trailing whitespace
+UNIT = re.compile(r"\S.*?(?:[.!?]+(?=\s|$)|(?=\n)|$)\s*", re.S)
+
+def tiktoken_tokenizer(model="gpt-3.5-turbo"):
+    """Return the OpenAI tokenizer for a model, or APPROX when tiktoken is not installed."""
+    try:
+        import tiktoken
+    except ImportError:
+        return APPROX
+    encoding = tiktoken.encoding_for_model(model)
+    return Tokenizer(lambda text: encoding.encode(text, disallowed_special=()), encoding.decode)
+
+def ctransformers_tokenizer(llm):
+    """Return the tokenizer of a loaded LangChain CTransformers model."""
+    client = llm.client
+    return Tokenizer(lambda text: client.tokenize(text, add_bos_token=False), client.detokenize)
+
+def is_heading(unit):
+    """Guess whether a unit is a heading: a markdown heading or a short line without end punctuation."""
+    line = unit.strip()
+    if line.startswith('#'):
+        return True
+    return unit.endswith('\n') and 0 < len(line.split()) <= 12 and line[-1] not in '.!?:;,'
+
+def iter_chunks(text, max_tokens=256, overlap=0, tokenizer=WORDS, boundaries=True):
+    """Yield chunks of text of at most ``max_tokens`` tokens in a single lazy pass.
+
+    Each sentence (or line) is tokenized once and packed into the current
+    chunk while it fits; a sentence longer than a chunk fills the room
+    left in one chunk after another. Consecutive chunks share about ``overlap``
+    tokens, taken as whole trailing sentences where they fit. With
+    ``boundaries`` a chunk that is at least half full is closed before a
+    heading; without it the text is cut purely by token count.
+    """
+    if overlap >= max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
+    current = deque()  # Token lists of the sentences in the chunk being built
+    size = 0
+    fresh = False  # Whether the chunk holds anything beyond the previous chunk's overlap
+
+    def emit():
+        """Return the current chunk's text and start the next chunk with its overlap."""
+        nonlocal size
+        tokens = [token for piece in current for token in piece]
+        chunk = tokenizer.decode(tokens).strip()
+        # Carry whole trailing sentences into the next chunk, or else the last overlap tokens
+        kept, kept_size = deque(), 0
+        for piece in reversed(current):
+            if kept_size + len(piece) > overlap:
+                break
+            kept.appendleft(piece)
+            kept_size += len(piece)
+        if not kept and overlap:
+            kept.append(tokens[-overlap:])
+            kept_size = len(kept[0])
+        current.clear()
+        current.extend(kept)
+        size = kept_size
+        return chunk
+
+    for unit in (UNIT.findall(text) if boundaries else [text]):
+        tokens = tokenizer.encode(unit)
+        if fresh and boundaries and is_heading(unit) and size * 2 >= max_tokens:
+            yield emit()
+            fresh = False
+        if len(tokens) <= max_tokens:
+            if fresh and size + len(tokens) > max_tokens:
+                yield emit()
+            # Drop overlap from the front when it leaves no room for the sentence
+            while current and size + len(tokens) > max_tokens:
+                size -= len(current.popleft())
+            current.append(tokens)
+            size += len(tokens)
+            fresh = True
+            continue
+        # A sentence longer than a chunk fills the room left in each chunk in turn
+        start = 0
+        while start < len(tokens):
+            if size == max_tokens:
+                yield emit()
+            piece = tokens[start:start + max_tokens - size]
+            current.append(piece)
+            size += len(piece)
+            start += len(piece)
+            fresh = True
+    if fresh:
+        yield emit()
+
+def chunk_text(text, max_tokens=256, overlap=0, tokenizer=WORDS, boundaries=True):
+    """Return the list of chunks produced by iter_chunks()."""
+    return list(iter_chunks(text, max_tokens, overlap, tokenizer, boundaries))
+
+def first_chunk(text, max_tokens, tokenizer=WORDS):
+    """Return the longest sentence-aligned prefix of text that fits in ``max_tokens`` tokens."""
+    return next(iter_chunks(text, max_tokens, tokenizer=tokenizer), "")
+
+def salience_order(chunks):
+    """Return chunk indices, densest first, by mean TF-IDF weight per word across the page's chunks.
+
+    Stop words are ignored and terms shared by every chunk (navigation,
+    boilerplate) weigh least, so chunks with many distinctive terms rank
+    first. Ties keep document order.
+    """
+    if len(chunks) < 2:
+        return list(range(len(chunks)))
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    try:
+        weights = TfidfVectorizer(stop_words='english', sublinear_tf=True, norm=None).fit_transform(chunks)
+    except ValueError:  # Only stop words
+        return list(range(len(chunks)))
+    density = [weights[i].sum() / max(1, len(chunk.split())) for i, chunk in enumerate(chunks)]
+    return sorted(range(len(chunks)), key=lambda i: -density[i])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chunk_text against the previous word-count splitter.")
+    parser.add_argument("--words", type=int, default=20000, help="Words in the synthetic page")
+    parser.add_argument("--max-tokens", type=int, default=256, help="Chunk size")
+    args = parser.parse_args()
+
+    def split_content(content, max_tokens=256):
+        """The splitter previously in model2.py, which re-joins the chunk for every word."""
+        words = content.split()
+        chunks = []
+        current_chunk = []
+        for word in words:
+            estimated_tokens = len(" ".join(current_chunk + [word]).split())
+            if estimated_tokens <= max_tokens:
+                current_chunk.append(word)
+            else:
+                chunks.append(" ".join(current_chunk))
+                current_chunk = [word]
+        if current_chunk:
+            chunks.append(" ".join(current_chunk))
+        return chunks
+
+    sentence = "The quick brown fox jumps over the lazy dog near the river bank today. "
+    text = (sentence * (args.words // len(sentence.split()) + 1)).strip()
+    for name, split in [("split_content (old)", lambda: split_content(text, args.max_tokens)),
+                        ("chunk_text words", lambda: chunk_text(text, args.max_tokens, boundaries=False)),
+                        ("chunk_text sentences", lambda: chunk_text(text, args.max_tokens)),
+                        ("chunk_text sentences+overlap", lambda: chunk_text(text, args.max_tokens, overlap=32))]:
+        start = time.perf_counter()
+        chunks = split()
+        elapsed = time.perf_counter() - start
+        print(f"{name:30s} {len(chunks):5d} chunks  {elapsed * 1000:9.1f} ms")
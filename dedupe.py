@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+
+import numpy as np
+from records import read_records
+from page_store import PageStore
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+def shingles(text, size=5):
+    """Return the set of word ``size``-grams of a text."""
+    words = text.lower().split()
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+class MinHasher:
+    """MinHash signatures estimating the Jaccard similarity of word shingles."""
+
+    def __init__(self, num_perm=128, seed=1):
+        generator = np.random.RandomState(seed)
+        # Keep a, b and the shingle hashes below 2**32 so (a * h + b) cannot overflow uint64
+        self.a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        """Return the MinHash signature of a text."""
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in shingles(text)),
+            dtype=np.uint64
+        )
+        if hashes.size == 0:
+            return np.full(len(self.a), MAX_HASH, dtype=np.uint64)
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME & MAX_HASH).min(axis=1)
+
+def find_duplicates(entries, threshold=0.85, num_perm=128, bands=16):
+    """Cluster near-duplicate pages and map every non-representative URL to its cluster's first URL.
+
+    Candidate pairs come from LSH banding of the MinHash signatures and are
+    kept when their estimated Jaccard similarity reaches ``threshold``.
+    Returns ``(duplicate_of, page_count)``.
+    """
+    hasher = MinHasher(num_perm)
+    rows = num_perm // bands
+    urls, signatures = [], []
+    buckets = {}
+    parent = []
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for entry in entries:
+        index = len(urls)
+        urls.append(entry['url'])
+        signature = hasher.signature(entry.get('content', ''))
+        signatures.append(signature)
+        parent.append(index)
+        for band in range(bands):
+            key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+            for other in buckets.setdefault(key, []):
+                if find(other) != find(index) and np.mean(signatures[other] == signature) >= threshold:
+                    # Keep the earliest page as the root, so it becomes the representative
+                    root, child = sorted((find(other), find(index)))
+                    parent[child] = root
+            buckets[key].append(index)
+
+    duplicate_of = {}
+    for index, url in enumerate(urls):
+        root = find(index)
+        if root != index:
+            duplicate_of[url] = urls[root]
+    return duplicate_of, len(urls)
+
+def load_duplicates(filename="duplicates.json"):
+    """Load the duplicate map written by this stage, or an empty map if there is none."""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+class ClusterFanOut:
+    """Run an expensive per-page step once per duplicate cluster.
+
+    Near-duplicate pages share the result of their cluster's first page, its
+    representative. Representatives come before their duplicates in crawl
+    order, so the result for a representative can be handed to every later
+    member of its cluster while streaming. ``calls_made`` and
+    ``calls_avoided`` count how often the step ran and how often it was
+    skipped.
+    """
+
+    def __init__(self, duplicate_of):
+        self.duplicate_of = duplicate_of
+        self.representatives = set(duplicate_of.values())
+        self.results = {}
+        self.calls_made = 0
+        self.calls_avoided = 0
+
+    def run(self, entries, generate):
+        """Yield ``(entry, result)`` for every entry, calling ``generate(entry)`` once per cluster."""
+        for entry in entries:
+            representative = self.duplicate_of.get(entry['url'])
+            if representative in self.results:
+                self.calls_avoided += 1
+                yield entry, self.results[representative]
+                continue
+            result = generate(entry)
+            self.calls_made += 1
+            if entry['url'] in self.representatives:
+                self.results[entry['url']] = result
+            yield entry, result
+
+    async def agenerate(self, entry, generate):
+        """Async counterpart of run() for one entry, awaiting ``generate(entry)`` once per cluster.
+
+        Duplicates await their representative's pending call, so entries may
+        be handed out concurrently as long as they are started in crawl order.
+        """
+        representative = self.duplicate_of.get(entry['url'])
+        if representative in self.results:
+            self.calls_avoided += 1
+            return await self.results[representative]
+        result = asyncio.ensure_future(generate(entry))
+        self.calls_made += 1
+        if entry['url'] in self.representatives:
+            self.results[entry['url']] = result
+        return await result
+
+    def report(self):
+        """Print how many calls the duplicate clusters saved."""
+        print(f"Near-duplicate clusters: {self.calls_made} LLM generations run, {self.calls_avoided} avoided")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate pages before question generation.")
+    parser.add_argument("--input", default="final_output.jsonl", help="Crawled content file")
+    parser.add_argument("--output", default="duplicates.json", help="Map of duplicate URL to representative URL")
+    parser.add_argument("--threshold", type=float, default=0.85, help="Minimum estimated Jaccard similarity")
+    parser.add_argument("--store", help="Read the pages from this page store instead of --input")
+    args = parser.parse_args()
+
+    pages = PageStore(args.store).pages() if args.store else read_records(args.input)
+    duplicate_of, page_count = find_duplicates(pages, threshold=args.threshold)
+    with open(args.output, 'w') as f:
+        json.dump(duplicate_of, f, indent=4)
+    clusters = page_count - len(duplicate_of)
+    print(f"{page_count} pages in {clusters} clusters; {len(duplicate_of)} LLM calls per model avoided")
+    print(f"Duplicate map saved to {args.output}")
@@ -0,0 +1,165 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+def text_hash(text):
+    """Return the SHA-256 hex digest of a text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EmbeddingStore:
+    """Content-addressed text embeddings in a memory-mapped float32 file.
+
+    ``index.json`` maps the hash of every embedded text to its row and the
+    day it was last used, so a text is embedded once no matter which page,
+    chunk or stage it comes from. Texts added with add() are queued and
+    encoded together in batches of ``batch_size`` by flush(). ``matrix`` is
+    the memory-mapped array itself, so stages can score against it without
+    copying. compact() drops rows unused for ``max_age_days`` and packs the
+    remaining ones to the front of the file. The store is meant for one
+    writer at a time.
+    """
+
+    def __init__(self, directory="embedding_store", model_name=EMBEDDING_MODEL, batch_size=64):
+        os.makedirs(directory, exist_ok=True)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.index_path = os.path.join(directory, "index.json")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+            if self.index["model"] != model_name:
+                raise ValueError(f"{directory} holds {self.index['model']} embeddings, not {model_name}")
+        else:
+            self.index = {"model": model_name, "dim": None, "capacity": 0, "rows": {}, "free": []}
+        self.matrix = None
+        if self.index["capacity"]:
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+',
+                                    shape=(self.index["capacity"], self.index["dim"]))
+        self.today = int(time.time() // 86400)
+        self.pending = {}  # hash -> text waiting to be encoded
+        self.model = None
+        self.encoded = 0
+        self.reused = 0
+
+    def _encode(self, texts):
+        """Embed texts as L2-normalized float32 vectors."""
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(self.model_name)
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+
+    def _allocate(self, dim):
+        """Return a free row, doubling the file when it is full."""
+        if not self.index["free"]:
+            self.index["dim"] = dim
+            old_capacity = self.index["capacity"]
+            capacity = max(1024, old_capacity * 2)
+            if self.matrix is not None:
+                self.matrix.flush()
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(capacity * dim * 4)
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(capacity, dim))
+            self.index["free"] = list(range(capacity - 1, old_capacity - 1, -1))
+            self.index["capacity"] = capacity
+        return self.index["free"].pop()
+
+    def add(self, texts):
+        """Queue the texts that are not stored yet and return the hashes of all of them."""
+        hashes = []
+        for text in texts:
+            digest = text_hash(text)
+            entry = self.index["rows"].get(digest)
+            if entry is not None:
+                entry[1] = self.today
+                self.reused += 1
+            elif digest not in self.pending:
+                self.pending[digest] = text
+                if len(self.pending) >= self.batch_size * 16:
+                    self.flush()
+            hashes.append(digest)
+        return hashes
+
+    def flush(self):
+        """Encode every queued text in batches and store the vectors."""
+        if not self.pending:
+            return
+        digests = list(self.pending)
+        for start in range(0, len(digests), self.batch_size):
+            batch = digests[start:start + self.batch_size]
+            vectors = self._encode([self.pending[digest] for digest in batch])
+            for digest, vector in zip(batch, vectors):
+                row = self._allocate(vectors.shape[1])
+                self.matrix[row] = vector
+                self.index["rows"][digest] = [row, self.today]
+        self.encoded += len(digests)
+        self.pending.clear()
+
+    def rows(self, hashes):
+        """Return the row numbers of the given hashes, encoding any still queued."""
+        self.flush()
+        return np.array([self.index["rows"][digest][0] for digest in hashes], dtype=np.int64)
+
+    def embed(self, texts):
+        """Return the embeddings of texts as an array, encoding only the ones not stored yet."""
+        if not texts:
+            return np.zeros((0, self.index["dim"] or 0), dtype=np.float32)
+        rows = self.rows(self.add(texts))
+        return self.matrix[rows]
+
+    def compact(self, max_age_days=30):
+        """Forget texts unused for ``max_age_days`` and pack the remaining rows into a smaller file."""
+        self.flush()
+        live = {digest: entry for digest, entry in self.index["rows"].items()
+                if self.today - entry[1] <= max_age_days}
+        dropped = len(self.index["rows"]) - len(live)
+        if self.matrix is None:
+            return dropped
+        capacity = max(1024, 1 << max(0, len(live) - 1).bit_length())
+        # Live rows move down in row order, so a row is never overwritten before it has been moved
+        order = sorted(live, key=lambda digest: live[digest][0])
+        for row, digest in enumerate(order):
+            if live[digest][0] != row:
+                self.matrix[row] = self.matrix[live[digest][0]]
+        self.matrix.flush()
+        del self.matrix
+        with open(self.vectors_path, 'r+b') as f:
+            f.truncate(capacity * self.index["dim"] * 4)
+        self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.index["dim"]))
+        self.index["rows"] = {digest: [row, live[digest][1]] for row, digest in enumerate(order)}
+        self.index["free"] = list(range(capacity - 1, len(order) - 1, -1))
+        self.index["capacity"] = capacity
+        self.save()
+        return dropped
+
+    def save(self):
+        """Encode anything queued, flush the vectors and write the index."""
+        self.flush()
+        if self.matrix is not None:
+            self.matrix.flush()
+        with open(self.index_path, 'w') as f:
+            json.dump(self.index, f)
+
+    def report(self):
+        """Print how many texts were encoded and how many were reused."""
+        print(f"Embedding store: {self.encoded} texts encoded, {self.reused} reused, "
+              f"{len(self.index['rows'])} stored")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact the shared embedding store.")
+    parser.add_argument("--directory", default="embedding_store")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--max-age-days", type=int, default=30, help="Drop texts unused for this many days")
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.directory, args.model)
+    dropped = store.compact(args.max_age_days)
+    print(f"Dropped {dropped} stale embeddings; {len(store.index['rows'])} kept "
+          f"in {store.index['capacity']} rows")
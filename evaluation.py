@@ -1,141 +1,242 @@
 import os
+import ast
 import json
+import asyncio
+import argparse
+import numpy as np
 from dotenv import load_dotenv
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import LLMChain
-from langchain.chains import SequentialChain
 from langchain.callbacks import get_openai_callback
 from langchain.prompts import PromptTemplate
+from records import read_records, RecordWriter
+from llm_cache import enable_llm_cache
+from chunker import first_chunk, tiktoken_tokenizer
+from llm_dispatcher import LLMDispatcher, estimate_tokens
+from incremental import page_hash
+from page_store import PageStore
+
+parser = argparse.ArgumentParser(description="Evaluate the generated questions and links of every page.")
+parser.add_argument("--input", default="merged_output.json", help="Merged content, questions and links")
+parser.add_argument("--output", default="evaluation_results.jsonl", help="One evaluation record per page")
+parser.add_argument("--workers", type=int, default=8, help="LLM calls in flight at once")
+parser.add_argument("--rpm", type=int, default=3500, help="Requests per minute allowed by the API")
+parser.add_argument("--tpm", type=int, default=90000, help="Tokens per minute allowed by the API")
+parser.add_argument("--api-base", default=os.getenv("OPENAI_API_BASE"),
+                    help="Chat completions base URL, e.g. a local stub server")
+parser.add_argument("--store", help="Read pages from and save evaluations to this page store instead of files")
+parser.add_argument("--full", action="store_true",
+                    help="With --store, evaluate every page again instead of only changed ones")
+args = parser.parse_args()
 
 # Load environment variables from a .env file
 load_dotenv()
 
+llm_cache = enable_llm_cache()
+
 # Retrieve the API key
 KEY = os.getenv("OPENAI_KEY")
-llm = ChatOpenAI(openai_api_key=KEY, model_name="gpt-3.5-turbo", temperature=0.5)
-
-# Define the templates
+llm = ChatOpenAI(openai_api_key=KEY, model_name="gpt-3.5-turbo", temperature=0.5, max_retries=0,
+                 openai_api_base=args.api_base)
+dispatcher = LLMDispatcher(workers=args.workers, rpm=args.rpm, tpm=args.tpm)
+
+# Rules checked locally; only relevance needs the model
+MAX_QUESTION_WORDS = 80
+QUESTION_COUNT = 10
+LINK_COUNT = 5
+MAX_TEXT_TOKENS = 2500
+tokenizer = tiktoken_tokenizer("gpt-3.5-turbo")
+
+# Define the template: relevance is the only judgement sent to the model
 Template = """
 Text : {text}
-You are an expert evaluator. Your job is to assess the quality of the multiple-choice questions (MCQs) generated from the given text. Evaluate the questions based on the following criteria and provide a score between 0 (lowest) and 100 (highest):
+Questions :
+{questions}
+You are an expert evaluator. Your job is to assess the quality of the multiple-choice questions (MCQs) generated from the given text.
 Relevance Check: Verify if the MCQs are relevant to the content provided and accurately reflect the information. Each question should be directly related to the text without any repetition.
-Word Count Check: Ensure that each MCQ contains fewer than 80 words.
-Question Count Check: Confirm that exactly 10 MCQs have been provided.
-Link Count Check: Ensure that exactly 5 relevant links are included.
+Give a relevance score between 0 (lowest) and 100 (highest).
 Make sure your response is in given json format
 
-{RESPONSE_JSON} 
+{RESPONSE_JSON}
 """
 
 RESPONSE_JSON = json.dumps({
     "relevance_check": "{Relevance check: PASS/FAIL}",
-    "word_count_check": "{Word count check: PASS/FAIL}",
-    "question_count_check": "{Question count: PASS/FAIL}",
-    "link_count_check": "{Link count: PASS/FAIL}",
-    "overall_score": "{Overall score out of 100}",
+    "relevance_score": "{Relevance score out of 100}",
     "feedback": "{Detailed feedback on what was done well or areas for improvement}"
 }, indent=4)
 
-# First prompt chain
 prompt1 = PromptTemplate(
-    input_variables=["text", "RESPONSE_JSON"],
+    input_variables=["text", "questions", "RESPONSE_JSON"],
     template=Template,
 )
 
 quiz_chain = LLMChain(llm=llm, prompt=prompt1, output_key="quiz", verbose=True)
 
-Template2 = """
-TEXT = {quiz}
-You are an expert evaluator. Your job is to assess the quality of the multiple-choice questions (MCQs) generated from the given text. Evaluate the questions based on the following criteria and provide a score between 0 (lowest) and 100 (highest). give the final answer in as a result(integer) and print the answer in score 
-Make sure you output the answer in given json format
-{RESPONSE_JSON1}
-"""
-
-RESPONSE_JSON1 = json.dumps({
-    "Total Score": "{score}"
-}, indent=4)
-
-# Second prompt chain
-quiz_ev_prompt = PromptTemplate(
-    input_variables=["quiz", "RESPONSE_JSON1"],
-    template=Template2,
-)
-
-review_chain = LLMChain(llm=llm, prompt=quiz_ev_prompt, output_key="review", verbose=True)
-
-# Sequential Chain combining both chains
-evaluate_chains = SequentialChain(
-    chains=[quiz_chain, review_chain],
-    input_variables=["text", "RESPONSE_JSON", "RESPONSE_JSON1"],
-    output_variables=["quiz", "review"],
-    verbose=True
-)
-
-def get_content_by_url(data, url):
-    """Retrieve content associated with a given URL from the JSON data."""
-    for item in data:
-        if item['url'] == url:
-            return item['content']
-    return None
-
-def evaluate_link_relevance(content, links, data):
+# What the previous two-call evaluation sent per page, used to estimate the tokens now avoided:
+# the full rubric prompt with the page text, then a second call to extract the score
+LEGACY_PROMPT_TOKENS = 330
+LEGACY_COMPLETION_TOKENS = 150
+LEGACY_REVIEW_TOKENS = 120 + LEGACY_COMPLETION_TOKENS + 15
+
+stats = {"pages": 0, "reused": 0, "llm_calls": 0, "llm_calls_avoided": 0, "hard_failures": 0,
+         "tokens": 0, "tokens_avoided": 0, "cost": 0.0, "scores": []}
+
+def parse_json(text):
+    """Parse the first JSON object in a model response, or return None."""
+    start, end = text.find('{'), text.rfind('}')
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+
+def as_list(value):
+    """Return a list field, also accepting the stringified lists found in older merged files."""
+    if isinstance(value, str):
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return [value]
+    return list(value or [])
+
+def local_checks(item):
+    """Run the mechanical checks; returns the check results and the list of failed rules."""
+    questions = as_list(item.get("questions"))
+    links = as_list(item.get("relevant_links"))
+    long_questions = [q for q in questions if len(q.split()) >= MAX_QUESTION_WORDS]
+    checks = {
+        "word_count_check": "PASS" if not long_questions else "FAIL",
+        "question_count_check": "PASS" if len(questions) == QUESTION_COUNT else "FAIL",
+        "link_count_check": "PASS" if len(links) == LINK_COUNT else "FAIL"
+    }
+    failures = []
+    if long_questions:
+        failures.append(f"{len(long_questions)} questions have {MAX_QUESTION_WORDS} words or more")
+    if len(questions) != QUESTION_COUNT:
+        failures.append(f"{len(questions)} questions instead of {QUESTION_COUNT}")
+    if len(links) != LINK_COUNT:
+        failures.append(f"{len(links)} relevant links instead of {LINK_COUNT}")
+    return checks, failures
+
+async def evaluate_item(item, text):
+    """Evaluate one page: local rule checks, then a single relevance call if every rule passes."""
+    checks, failures = local_checks(item)
+    # The old flow always made two calls: the rubric prompt with the whole text, then the score extraction
+    legacy_tokens = LEGACY_PROMPT_TOKENS + len(tokenizer.encode(text)) + LEGACY_COMPLETION_TOKENS
+    stats["pages"] += 1
+    if failures:
+        stats["hard_failures"] += 1
+        stats["llm_calls_avoided"] += 2
+        stats["tokens_avoided"] += legacy_tokens + LEGACY_REVIEW_TOKENS
+        quiz = dict(relevance_check="SKIPPED", relevance_score=None, **checks, overall_score=0,
+                    feedback="Failed hard rules: " + "; ".join(failures))
+        return quiz
+
+    inputs = {
+        "text": first_chunk(text, MAX_TEXT_TOKENS, tokenizer),
+        "questions": "\n".join(as_list(item["questions"])),
+        "RESPONSE_JSON": RESPONSE_JSON
+    }
+    with get_openai_callback() as cb:  # Per task: the callback lives in the task's own context
+        response = await dispatcher.call(lambda: quiz_chain.arun(inputs),
+                                         estimate_tokens(Template + inputs["text"] + inputs["questions"]))
+    stats["llm_calls"] += 1
+    stats["llm_calls_avoided"] += 1
+    stats["tokens"] += cb.total_tokens
+    stats["cost"] += cb.total_cost
+    stats["tokens_avoided"] += LEGACY_REVIEW_TOKENS + max(0, legacy_tokens - cb.total_tokens)
+
+    judgement = parse_json(response) or {}
+    try:
+        score = max(0, min(100, int(float(judgement.get("relevance_score")))))
+    except (TypeError, ValueError):
+        score = 0
+    return {
+        "relevance_check": judgement.get("relevance_check", "FAIL"),
+        "relevance_score": score,
+        **checks,
+        "overall_score": score,
+        "feedback": judgement.get("feedback", response)
+    }
+
+def evaluate_link_relevance(content, links, content_by_url):
     """Evaluate the relevance of links based on their content."""
     link_relevance = []
     for link in links:
-        link_content = get_content_by_url(data, link)
+        url = link['url'] if isinstance(link, dict) else link
+        link_content = content_by_url.get(url)
         if link_content:
             # Here you would include logic to evaluate relevance
             # For demonstration, let's assume all links are relevant
             relevance = "Relevant"  # Placeholder, replace with actual evaluation
             link_relevance.append({
-                "link": link,
+                "link": url,
                 "relevance": relevance
             })
     return link_relevance
 
-# Load input data from JSON file
-with open('merged_output.json', 'r') as file:
-    input_data = json.load(file)
-
-# Process each item in the list
-for item in input_data:
-    text = item.get("content", "")
-    relevant_links = item.get("relevant_links", [])  # Ensure this key exists
-
-    if text:  # Ensure text is not empty
-        # Process the data and get the response
-        with get_openai_callback() as cb:
-            response = evaluate_chains({
-                "text": text,
-                "RESPONSE_JSON": RESPONSE_JSON,
-                "RESPONSE_JSON1": RESPONSE_JSON1
-            })
-
-        # Print token usage
-        print(f"Total tokens: {cb.total_tokens}")
-        print(f"Prompt Tokens: {cb.prompt_tokens}")
-        print(f"Completion Tokens: {cb.completion_tokens}")
-        print(f"Total cost: {cb.total_cost}")
-
-        # Extract and print results
-        quiz = response.get("quiz", "")
-        review = response.get("review", "")
-
-        print("Quiz evaluation:")
-        print(quiz)
-        print("\nReview:")
-        print(review)
-
+def input_hash(item):
+    """Fingerprint everything an evaluation depends on: the content, questions and links of a page."""
+    return page_hash(json.dumps([item["content"], item.get("questions"), item.get("relevant_links")]))
+
+async def evaluate_page(item):
+    """Return the evaluation record of one page, reusing the stored one if its inputs are unchanged."""
+    if previous:
+        evaluation = previous.get(item["url"])
+        if evaluation is not None and evaluation.get("input_hash") == input_hash(item):
+            stats["reused"] += 1
+            stats["scores"].append(evaluation["overall_score"])
+            return evaluation
+    text = item["content"]
+    quiz = await evaluate_item(item, text)
+    stats["scores"].append(quiz["overall_score"])
+    record = {
+        "url": item["url"],
+        "overall_score": quiz["overall_score"],
+        "quiz": quiz,
+        "review": {"Total Score": quiz["overall_score"]},
         # Check relevance of the relevant links
-        link_relevance = evaluate_link_relevance(text, relevant_links, input_data)
-
-        # Save results to JSON file
-        output_data = {
-            "quiz": json.loads(quiz),
-            "review": json.loads(review),
-            "link_relevance": link_relevance
-        }
-
-        output_filename = f'output_{item.get("id", "unknown")}.json'
-        with open(output_filename, 'w') as file:
-            json.dump(output_data, file, indent=4)
+        "link_relevance": evaluate_link_relevance(text, as_list(item.get("relevant_links")), content_by_url)
+    }
+    if store:
+        record.update(content_hash=page_hash(text), input_hash=input_hash(item))
+    return record
+
+async def evaluate_all():
+    """Stream the evaluation of every page with content into the output file, in input order."""
+    pages = store.merged() if store else read_records(args.input)
+    items = (item for item in pages if item.get("content"))  # Ensure text is not empty
+    with (store.writer("evaluations") if store else RecordWriter(args.output)) as writer:
+        async for item, record in dispatcher.run(items, evaluate_page):
+            writer.write(record)
+
+def report():
+    """Print the score distribution, token use, cost and LLM latency percentiles."""
+    scores = np.array(stats["scores"], dtype=float)
+    if stats["reused"]:
+        print(f"Reused the stored evaluations of {stats['reused']} unchanged pages")
+    print(f"Evaluated {stats['pages']} pages: {stats['llm_calls']} LLM calls made, "
+          f"{stats['llm_calls_avoided']} avoided ({stats['hard_failures']} pages failed hard rules and skipped the LLM)")
+    if scores.size:
+        print(f"Scores: mean {scores.mean():.1f}, median {np.median(scores):.1f}, min {scores.min():.0f}, max {scores.max():.0f}")
+        counts = np.histogram(scores, bins=range(0, 110, 10))[0]
+        for low, count in zip(range(0, 100, 10), counts):
+            print(f"  {low:3d}-{low + 9 if low < 90 else 100:<3d} {count:5d} {'#' * int(40 * count / max(counts.max(), 1))}")
+    print(f"Tokens used: {stats['tokens']}, tokens avoided (estimated): {stats['tokens_avoided']}")
+    print(f"Total cost: {stats['cost']}")
+    if dispatcher.latencies:
+        p50, p90, p99 = np.percentile(dispatcher.latencies, [50, 90, 99])
+        print(f"LLM latency: p50 {p50:.2f}s, p90 {p90:.2f}s, p99 {p99:.2f}s, max {max(dispatcher.latencies):.2f}s")
+
+store = PageStore(args.store) if args.store else None
+# Evaluations of pages whose content, questions and links have not changed are kept
+previous = store.table("evaluations") if store and not args.full else {}
+
+# Link relevance looks up other pages' content, so index it by URL once
+content_by_url = {item['url']: item.get('content', '') for item in (store.pages() if store else read_records(args.input))}
+
+asyncio.run(evaluate_all())
+report()
+dispatcher.report()
+llm_cache.report()
+print(f"Evaluations saved to {args.store or args.output}")
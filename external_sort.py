@@ -0,0 +1,141 @@
+import heapq
+import json
+import os
+import shutil
+import sys
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+
+# Rough per-record cost of the buffered tuple and string objects, on top of the JSON text itself
+RECORD_OVERHEAD = 200
+# Most runs open at once while merging; more are first merged into longer runs, in as many passes as needed
+MERGE_FAN_IN = 64
+
+class ExternalSorter:
+    """Sorts (key, value) pairs in bounded memory, spilling sorted runs to temporary files.
+
+    Pairs are buffered as JSON until the buffer reaches about
+    ``memory_bytes``; the buffer is then sorted and written out as a run.
+    Iterating merges the runs with whatever is still buffered. Keys must be
+    JSON values that compare with each other (strings, numbers or lists of
+    them), and pairs with equal keys come out in the order they were added.
+    At most ``fan_in`` runs are open at a time; ``spilled`` counts the runs
+    written from the buffer and ``merge_passes`` the passes over the runs.
+    """
+
+    def __init__(self, memory_bytes=256 << 20, directory=None, fan_in=MERGE_FAN_IN):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.fan_in = max(2, fan_in)
+        self.tmpdir = None
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.runs = []
+        self.spilled = 0
+        self.merge_passes = 0
+        self.count = 0
+
+    def add(self, key, value):
+        line = json.dumps([key, self.count, value])
+        self.buffer.append((key, self.count, line))
+        self.buffered_bytes += len(line) + RECORD_OVERHEAD
+        self.count += 1
+        if self.buffered_bytes >= self.memory_bytes:
+            self._spill()
+
+    def _spill(self):
+        """Write the buffer out as one sorted run."""
+        if self.tmpdir is None:
+            self.tmpdir = tempfile.mkdtemp(prefix="sort-", dir=self.directory)
+        self.buffer.sort(key=itemgetter(0, 1))
+        path = os.path.join(self.tmpdir, f"run{self.spilled}.jsonl")
+        with open(path, 'w') as f:
+            for _, _, line in self.buffer:
+                f.write(line + "\n")
+        self.runs.append(path)
+        self.spilled += 1
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def _read_run(self, path):
+        with open(path, 'r') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _merge_runs(self):
+        """Merge groups of ``fan_in`` runs into longer runs until the last merge can open them all at once."""
+        merged = 0
+        while len(self.runs) > self.fan_in:
+            runs = []
+            for start in range(0, len(self.runs), self.fan_in):
+                group = self.runs[start:start + self.fan_in]
+                if len(group) == 1:
+                    runs.extend(group)
+                    continue
+                path = os.path.join(self.tmpdir, f"merged{merged}.jsonl")
+                merged += 1
+                with open(path, 'w') as f:
+                    for entry in heapq.merge(*(self._read_run(run) for run in group), key=itemgetter(0, 1)):
+                        f.write(json.dumps(entry) + "\n")
+                for run in group:
+                    os.remove(run)
+                runs.append(path)
+            self.runs = runs
+            self.merge_passes += 1
+
+    def __iter__(self):
+        """Yield the (key, value) pairs in key order."""
+        self._merge_runs()
+        if self.runs:
+            self.merge_passes += 1
+        self.buffer.sort(key=itemgetter(0, 1))
+        streams = [self._read_run(path) for path in self.runs]
+        streams.append(json.loads(line) for _, _, line in self.buffer)
+        for key, _, value in heapq.merge(*streams, key=itemgetter(0, 1)):
+            yield key, value
+
+    def close(self):
+        """Delete the spilled runs."""
+        self.buffer = []
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def merge_join(left, right):
+    """Full outer join of two iterables of (key, value) pairs that are sorted by key.
+
+    Yields ``(key, left_values, right_values)`` once for every key found in
+    either input; one of the two lists is empty when the key is only on one
+    side. Only one key's values are held at a time.
+    """
+    left_groups = groupby(left, key=itemgetter(0))
+    right_groups = groupby(right, key=itemgetter(0))
+    left_group = next(left_groups, None)
+    right_group = next(right_groups, None)
+    while left_group is not None or right_group is not None:
+        if right_group is None or (left_group is not None and left_group[0] < right_group[0]):
+            yield left_group[0], [value for _, value in left_group[1]], []
+            left_group = next(left_groups, None)
+        elif left_group is None or right_group[0] < left_group[0]:
+            yield right_group[0], [], [value for _, value in right_group[1]]
+            right_group = next(right_groups, None)
+        else:
+            yield left_group[0], [value for _, value in left_group[1]], [value for _, value in right_group[1]]
+            left_group = next(left_groups, None)
+            right_group = next(right_groups, None)
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in MB, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024  # Bytes on macOS, KB on Linux
@@ -0,0 +1,210 @@
+import argparse
+import re
+import sqlite3
+import time
+from urllib.parse import urljoin, urlsplit
+
+from bs4 import BeautifulSoup, Tag
+
+from boilerplate import BLOCK_TAGS, block_fingerprint
+
+# lxml builds the tree several times faster than the pure-Python html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+LOCATION_HREF = re.compile(r"window\.location\.href\s*=\s*['\"]([^'\"]+)['\"]")
+AJAX_URL = re.compile(r"\$.ajax\(\{.*?url\s*:\s*['\"]([^'\"]+)['\"]", re.DOTALL)
+INVALID_EXTENSIONS = ('.pdf', '.docx', '.doc', '.xlsx', '.xls', '.ppt', '.pptx', '.zip')
+
+class LinkResolver:
+    """Resolves references found on one page, keeping only crawlable links on the same host.
+
+    The page URL is parsed once instead of once per link.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.netloc = urlsplit(base_url).netloc
+
+    def __call__(self, reference):
+        """Return the absolute URL of a reference, or None if it is external or not a page."""
+        link = urljoin(self.base_url, reference)
+        if '#' in link or link.lower().endswith(INVALID_EXTENSIONS) or urlsplit(link).netloc != self.netloc:
+            return None
+        return link
+
+def extract_page(html, url, parser=None):
+    """Parse a page and collect everything the crawl keeps in one walk over the document.
+
+    Returns ``(content, title, links, anchors, blocks)`` as parse_page in
+    a_tag.py always has: the text of ``get_text(separator=" ", strip=True)``,
+    the first anchor's text (or the page title), the unique internal links
+    from anchors, buttons, scripts and forms, the anchor records of anchor.py
+    and the text blocks of boilerplate.py.
+    """
+    soup = BeautifulSoup(html, parser or HTML_PARSER)
+    resolve = LinkResolver(url)
+    string_types = soup.interesting_string_types
+    if isinstance(string_types, type):
+        string_types = (string_types,)
+
+    parts, blocks, block_parts = [], [], []
+    links, anchors = {}, []  # links is an insertion-ordered set
+    block_of = {}  # id(tag) -> the tag's nearest block-level element, itself included
+    current = None
+    first_anchor_text, title_tag = None, None
+
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            name = node.name
+            block_of[id(node)] = node if name in BLOCK_TAGS else block_of.get(id(node.parent))
+            if name == 'a':
+                href = node.get('href')
+                if href is None:
+                    continue
+                anchor_text = node.get_text(strip=True)
+                if first_anchor_text is None:
+                    first_anchor_text = anchor_text
+                link = resolve(href)
+                if link:
+                    links[link] = None
+                    if anchor_text:
+                        anchors.append({"url": link, "title": anchor_text})
+            elif name == 'button':
+                # Buttons that navigate through an onclick handler
+                match = LOCATION_HREF.search(node.get('onclick', '')) if node.has_attr('href') else None
+                link = match and resolve(match.group(1))
+                if link:
+                    links[link] = None
+            elif name == 'script':
+                # window.location.href redirections and AJAX or dynamic URL loading
+                if node.string:
+                    for pattern in (LOCATION_HREF, AJAX_URL):
+                        for reference in pattern.findall(node.string):
+                            link = resolve(reference)
+                            if link:
+                                links[link] = None
+            elif name == 'form':
+                action = node.get('action')
+                link = action and resolve(action)
+                if link:
+                    links[link] = None
+            elif name == 'title' and title_tag is None:
+                title_tag = node
+        elif type(node) in string_types:
+            text = node.strip()
+            if not text:
+                continue
+            parts.append(text)
+            block = block_of.get(id(node.parent))
+            if block_parts and block is not current:
+                joined = " ".join(block_parts)
+                blocks.append([block_fingerprint(current, joined), len(joined)])
+                block_parts = []
+            current = block
+            block_parts.append(text)
+    if block_parts:
+        joined = " ".join(block_parts)
+        blocks.append([block_fingerprint(current, joined), len(joined)])
+
+    title = first_anchor_text
+    if not title:
+        title = title_tag.string if title_tag and title_tag.string and title_tag.string.strip() else 'No Title'
+    return " ".join(parts), title, list(links), anchors, blocks
+
+def saved_pages(cache_path, limit=None):
+    """Return (url, html) for the pages stored in the HTTP cache."""
+    conn = sqlite3.connect(cache_path)
+    query = "SELECT key, body FROM responses" + (f" LIMIT {int(limit)}" if limit else "")
+    pages = conn.execute(query).fetchall()
+    conn.close()
+    return pages
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark page parsing on the pages saved in the HTTP cache.")
+    parser.add_argument("--cache", default=".http_cache.sqlite", help="HTTP cache written by a_tag.py --cache")
+    parser.add_argument("--files", nargs="*", help="HTML files to parse instead of the cached pages")
+    parser.add_argument("--limit", type=int, help="Parse at most this many pages")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the pages")
+    args = parser.parse_args()
+
+    from a_tag import get_anchor_text
+    from anchor import get_anchor_tags
+    from boilerplate import page_blocks
+
+    def extract_links(soup, base_url):
+        """The link extraction previously in a_tag.py: four tree walks, one URL parse per check."""
+        def is_internal_link(url, base_url):
+            return urlsplit(url).netloc == urlsplit(base_url).netloc
+
+        def is_valid_url(url):
+            return not ('#' in url or url.lower().endswith(INVALID_EXTENSIONS))
+
+        links = []
+        for a_tag in soup.find_all('a', href=True):
+            link = urljoin(base_url, a_tag['href'])
+            if is_internal_link(link, base_url) and is_valid_url(link):
+                links.append(link)
+        for button in soup.find_all(['button', 'a'], href=True):
+            if button.name == 'a':
+                link = urljoin(base_url, button['href'])
+                if is_internal_link(link, base_url) and is_valid_url(link):
+                    links.append(link)
+            elif button.name == 'button':
+                match = re.search(r"window\.location\.href\s*=\s*['\"]([^'\"]+)['\"]", button.get('onclick', ''))
+                if match:
+                    link = urljoin(base_url, match.group(1))
+                    if is_internal_link(link, base_url) and is_valid_url(link):
+                        links.append(link)
+        for script in soup.find_all('script'):
+            if script.string:
+                for match in re.findall(r"window\.location\.href\s*=\s*['\"]([^'\"]+)['\"]", script.string):
+                    link = urljoin(base_url, match)
+                    if is_internal_link(link, base_url) and is_valid_url(link):
+                        links.append(link)
+                for match in re.findall(r"\$.ajax\(\{.*?url\s*:\s*['\"]([^'\"]+)['\"]", script.string, re.DOTALL):
+                    link = urljoin(base_url, match)
+                    if is_internal_link(link, base_url) and is_valid_url(link):
+                        links.append(link)
+        for form in soup.find_all('form'):
+            action = form.get('action')
+            if action:
+                link = urljoin(base_url, action)
+                if is_internal_link(link, base_url) and is_valid_url(link):
+                    links.append(link)
+        return list(set(links))
+
+    def previous_parse(html, url):
+        """parse_page as it was: html.parser, then a separate walk for each field."""
+        soup = BeautifulSoup(html, 'html.parser')
+        content = soup.get_text(separator=" ", strip=True)
+        return content, get_anchor_text(soup), extract_links(soup, url), get_anchor_tags(url, soup), page_blocks(soup)
+
+    if args.files:
+        pages = [(f"https://example.com/{path}", open(path, errors='replace').read()) for path in args.files]
+    else:
+        pages = saved_pages(args.cache, args.limit)
+    if args.limit:
+        pages = pages[:args.limit]
+    print(f"{len(pages)} pages, {sum(len(html) for _, html in pages) / 1e6:.1f} MB of HTML")
+
+    candidates = [("previous (html.parser, 5 walks)", previous_parse),
+                  ("extract_page html.parser", lambda html, url: extract_page(html, url, "html.parser"))]
+    if HTML_PARSER == "lxml":
+        candidates.append(("extract_page lxml", lambda html, url: extract_page(html, url, "lxml")))
+    results = {}
+    for name, parse in candidates:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            results[name] = [parse(html, url) for url, html in pages]
+        elapsed = time.perf_counter() - start
+        print(f"{name:34s} {len(pages) * args.repeat / elapsed:8.1f} pages/sec")
+
+    # The single walk must find exactly what the separate walks found on the same tree
+    baseline, single = results[candidates[0][0]], results[candidates[1][0]]
+    mismatched = sum(1 for old, new in zip(baseline, single)
+                     if (old[0], old[1], sorted(old[2]), old[3], old[4]) != (new[0], new[1], sorted(new[2]), new[3], new[4]))
+    print(f"html.parser results differing from the previous parse: {mismatched} of {len(pages)} pages")
@@ -0,0 +1,147 @@
+import base64
+import hashlib
+import math
+from collections import deque, Counter
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def canonicalize_url(url):
+    """Return the canonical form of a URL used to detect duplicate pages.
+
+    The scheme and host are lowercased, ``http`` and ``https`` are treated as
+    the same page, default ports, fragments and trailing slashes are dropped
+    and query parameters are sorted.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    if scheme in DEFAULT_PORTS:
+        scheme = "https"
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+class BloomFilter:
+    """Compact probabilistic set of strings.
+
+    Membership tests may return false positives at roughly ``error_rate`` once
+    ``capacity`` items have been added, but never false negatives.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        """Return the bit positions for an item using double hashing."""
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        """Add an item to the set."""
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        """Return whether the item may have been added."""
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class Frontier:
+    """BFS crawl queue that deduplicates canonical URLs when they are enqueued.
+
+    ``max_depth`` limits how many links away from the start URL the crawl
+    goes, ``max_pages`` limits how many URLs are handed out in total and
+    ``prefix_budgets`` maps path prefixes (e.g. ``"/notices/"``) to the number
+    of URLs that may be enqueued under them; the longest matching prefix
+    applies. With ``bloom_capacity`` the seen set is a BloomFilter instead of
+    a Python set, trading a small false-positive rate for much less memory.
+    """
+
+    def __init__(self, max_depth=None, max_pages=None, prefix_budgets=None, bloom_capacity=None, error_rate=0.001):
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.prefix_budgets = dict(prefix_budgets or {})
+        self.prefix_counts = Counter()
+        self.seen = BloomFilter(bloom_capacity, error_rate) if bloom_capacity else set()
+        self.queue = deque()
+        self.popped = 0
+
+    def _budget_prefix(self, url):
+        """Return the longest budgeted path prefix matching the URL, if any."""
+        path = urlsplit(url).path or "/"
+        matches = [prefix for prefix in self.prefix_budgets if path.startswith(prefix)]
+        return max(matches, key=len) if matches else None
+
+    def add(self, url, depth=0):
+        """Enqueue a URL unless it was already seen or is over a budget; return whether it was added."""
+        key = canonicalize_url(url)
+        if key in self.seen:
+            return False
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        prefix = self._budget_prefix(url)
+        if prefix is not None:
+            if self.prefix_counts[prefix] >= self.prefix_budgets[prefix]:
+                return False
+            self.prefix_counts[prefix] += 1
+        self.seen.add(key)
+        self.queue.append((url, depth))
+        return True
+
+    def pop(self):
+        """Return the next (url, depth) pair, or None when empty or the page budget is spent."""
+        if not self.queue or (self.max_pages is not None and self.popped >= self.max_pages):
+            return None
+        self.popped += 1
+        return self.queue.popleft()
+
+    def state(self, pending=()):
+        """Return a JSON-serializable snapshot of the frontier.
+
+        ``pending`` are (url, depth) pairs that were popped but not finished;
+        they are put back at the head of the queue in the snapshot.
+        """
+        if isinstance(self.seen, BloomFilter):
+            seen = {"bloom": base64.b64encode(self.seen.bits).decode("ascii"),
+                    "size": self.seen.size, "hash_count": self.seen.hash_count}
+        else:
+            seen = sorted(self.seen)
+        return {
+            "queue": [list(item) for item in pending] + [list(item) for item in self.queue],
+            "seen": seen,
+            "prefix_counts": dict(self.prefix_counts),
+            "popped": self.popped - len(pending)
+        }
+
+    def restore(self, state):
+        """Load a snapshot taken with state(), keeping this frontier's limits."""
+        self.queue = deque((url, depth) for url, depth in state["queue"])
+        if isinstance(state["seen"], dict):
+            self.seen = BloomFilter.__new__(BloomFilter)
+            self.seen.size = state["seen"]["size"]
+            self.seen.hash_count = state["seen"]["hash_count"]
+            self.seen.bits = bytearray(base64.b64decode(state["seen"]["bloom"]))
+        else:
+            self.seen = set(state["seen"])
+        self.prefix_counts = Counter(state["prefix_counts"])
+        self.popped = state["popped"]
+
+    def __len__(self):
+        if self.max_pages is not None:
+            return min(len(self.queue), max(0, self.max_pages - self.popped))
+        return len(self.queue)
+
+def parse_budgets(values):
+    """Parse ``PREFIX=N`` command-line values into a prefix budget dict."""
+    budgets = {}
+    for value in values or []:
+        prefix, _, limit = value.rpartition("=")
+        budgets[prefix] = int(limit)
+    return budgets
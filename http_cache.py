@@ -0,0 +1,148 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import namedtuple
+
+import requests
+
+from frontier import canonicalize_url
+
+# Result of a fetch through the cache. ``not_modified`` is True when the
+# server answered 304 and ``text`` is the body stored by an earlier crawl.
+FetchResult = namedtuple("FetchResult", ["status_code", "text", "content_hash", "not_modified"])
+
+def content_hash(text):
+    """Return the SHA-256 hex digest of a response body."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class HTTPCache:
+    """On-disk response cache with ETag/Last-Modified revalidation.
+
+    Entries older than ``ttl`` seconds are discarded, and the least recently
+    validated entries are evicted once the stored bodies exceed ``max_bytes``.
+    Parsed results can be stored next to a response so that pages answered
+    with 304 Not Modified do not need to be parsed again.
+    """
+
+    def __init__(self, path=".http_cache.sqlite", ttl=7 * 24 * 3600, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.parses_skipped = 0
+        self.evicted = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT NOT NULL,
+                validated_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS parsed (
+                key TEXT NOT NULL,
+                namespace TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (key, namespace)
+            );
+        """)
+
+    def _entry(self, url):
+        """Return the stored (body, etag, last_modified, content_hash) for a URL, if still within the TTL."""
+        row = self.conn.execute(
+            "SELECT body, etag, last_modified, content_hash, validated_at FROM responses WHERE key = ?",
+            (canonicalize_url(url),)
+        ).fetchone()
+        if row is None or time.time() - row[4] > self.ttl:
+            return None
+        return row[:4]
+
+    def conditional_headers(self, url):
+        """Return the If-None-Match/If-Modified-Since headers for a cached URL."""
+        entry = self._entry(url)
+        headers = {}
+        if entry:
+            _, etag, last_modified, _ = entry
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def record_response(self, url, status_code, text, headers):
+        """Store a response (or revalidate on 304) and return the resulting FetchResult."""
+        key = canonicalize_url(url)
+        now = time.time()
+        if status_code == 304:
+            entry = self._entry(url)
+            if entry:
+                self.hits += 1
+                self.conn.execute("UPDATE responses SET validated_at = ? WHERE key = ?", (now, key))
+                self.conn.commit()
+                return FetchResult(200, entry[0], entry[3], True)
+        self.misses += 1
+        if status_code != 200:
+            return FetchResult(status_code, "", None, False)
+
+        digest = content_hash(text)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, text, headers.get("ETag"), headers.get("Last-Modified"), digest, now, len(text.encode("utf-8")))
+        )
+        self.conn.commit()
+        return FetchResult(200, text, digest, False)
+
+    def fetch(self, url, session=requests):
+        """Fetch a URL, revalidating any cached copy with a conditional request."""
+        response = session.get(url, headers=self.conditional_headers(url))
+        return self.record_response(url, response.status_code, response.text, response.headers)
+
+    def load_parsed(self, url, namespace, digest):
+        """Return the parsed result stored for this exact body, or None."""
+        row = self.conn.execute(
+            "SELECT content_hash, data FROM parsed WHERE key = ? AND namespace = ?",
+            (canonicalize_url(url), namespace)
+        ).fetchone()
+        if row is None or row[0] != digest:
+            return None
+        self.parses_skipped += 1
+        return json.loads(row[1])
+
+    def save_parsed(self, url, namespace, digest, data):
+        """Store a JSON-serializable parsed result for a response body."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO parsed VALUES (?, ?, ?, ?)",
+            (canonicalize_url(url), namespace, digest, json.dumps(data))
+        )
+        self.conn.commit()
+
+    def evict(self):
+        """Drop expired entries, then the least recently validated ones until under the size limit."""
+        cursor = self.conn.execute("DELETE FROM responses WHERE validated_at < ?", (time.time() - self.ttl,))
+        self.evicted += cursor.rowcount
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY validated_at").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                self.evicted += 1
+        self.conn.execute("DELETE FROM parsed WHERE key NOT IN (SELECT key FROM responses)")
+        self.conn.commit()
+
+    def report(self):
+        """Print the hit/miss counters for this crawl."""
+        print(f"HTTP cache: {self.hits} hits (304), {self.misses} misses, "
+              f"{self.parses_skipped} parses skipped, {self.evicted} entries evicted")
+
+    def close(self):
+        """Evict stale entries and close the cache."""
+        self.evict()
+        self.conn.close()
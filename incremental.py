@@ -0,0 +1,40 @@
+import hashlib
+import os
+
+from records import read_records
+
+def page_hash(content):
+    """Return the fingerprint stored next to a page's generated questions and links."""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def load_previous(filename):
+    """Load the records of a previous run by URL, or an empty map if there is none.
+
+    The file is read completely, so the same path can then be rewritten.
+    """
+    if not os.path.exists(filename):
+        return {}
+    return {record['url']: record for record in read_records(filename)}
+
+class ChangeCounter:
+    """Counts pages reused from the previous run, regenerated, and dropped since it."""
+
+    def __init__(self, previous):
+        self.previous_urls = set(previous)
+        self.seen = set()
+        self.reused = 0
+        self.regenerated = 0
+
+    def count(self, url, reused):
+        """Record that a page's output was either reused or generated again."""
+        self.seen.add(url)
+        if reused:
+            self.reused += 1
+        else:
+            self.regenerated += 1
+
+    def report(self, what):
+        """Print the counts, with the pages of the previous run that were not seen counted as dropped."""
+        dropped = len(self.previous_urls - self.seen)
+        print(f"Incremental {what}: {self.regenerated} pages regenerated, {self.reused} reused, "
+              f"{dropped} deleted pages dropped")
@@ -0,0 +1,333 @@
+import argparse
+import hashlib
+import itertools
+import os
+import queue
+import secrets
+import stat
+import threading
+import time
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.llms import LLM
+
+ADDRESS = ("127.0.0.1", 6001)
+AUTHKEY_FILE = os.getenv("INFERENCE_AUTHKEY_FILE", os.path.join(os.path.expanduser("~"), ".inference_server_key"))
+MODEL_PATH = os.getenv("LLAMA_MODEL_PATH", "llama-2-7b-chat.ggmlv3.q4_0.bin")
+
+# Lower numbers are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+def load_authkey(create=False):
+    """Return the key that clients of the inference server must present.
+
+    INFERENCE_AUTHKEY overrides it; otherwise it is read from AUTHKEY_FILE.
+    With ``create`` (the server), a random key is written there on first
+    start, readable by its owner only. Connections carry pickles, so a key
+    file others can read is refused.
+    """
+    if os.getenv("INFERENCE_AUTHKEY"):
+        return os.getenv("INFERENCE_AUTHKEY").encode()
+    if create:
+        try:
+            fd = os.open(AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+    try:
+        mode = os.stat(AUTHKEY_FILE).st_mode
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"No inference server key at {AUTHKEY_FILE}; start the server first: python inference_server.py"
+        ) from None
+    if os.name == "posix" and mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise PermissionError(f"{AUTHKEY_FILE} is accessible to other users; run: chmod 600 {AUTHKEY_FILE}")
+    with open(AUTHKEY_FILE, 'r') as f:
+        return f.read().strip().encode()
+
+class CTransformersBackend:
+    """The llama model loaded once through LangChain's CTransformers wrapper.
+
+    ctransformers generates one sequence at a time, so a batch is run prompt
+    by prompt; identical prompts within a batch are still generated once.
+    """
+
+    name = "ctransformers"
+
+    def __init__(self, model=MODEL_PATH, model_type="llama", config=None):
+        from langchain_community.llms import CTransformers
+        self.model = model
+        self.config = config or {'max_new_tokens': 512, 'temperature': 0.8}
+        self.llm = CTransformers(model=model, model_type=model_type, config=self.config)
+
+    def generate(self, prompts):
+        """Return the completion of each prompt."""
+        return [self.llm.invoke(prompt) for prompt in prompts]
+
+    def tokenize(self, text):
+        """Return the model's token ids for a text, without the BOS token."""
+        return self.llm.client.tokenize(text, add_bos_token=False)
+
+    def detokenize(self, tokens):
+        """Return the text of a list of token ids."""
+        return self.llm.client.detokenize(tokens)
+
+class StubBackend:
+    """Deterministic stand-in for the model, for testing the server and its clients without weights.
+
+    Completions are ten numbered questions derived from a hash of the prompt,
+    after ``delay`` seconds per prompt; tokens are whitespace-separated words.
+    """
+
+    name = "stub"
+
+    def __init__(self, delay=0.0):
+        self.model = "stub"
+        self.config = {}
+        self.delay = delay
+
+    def generate(self, prompts):
+        """Return a fake completion for each prompt."""
+        time.sleep(self.delay * len(prompts))
+        return ["\n".join(f"{i + 1}. Stub question {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]}-{i}?"
+                          for i in range(10)) for prompt in prompts]
+
+    def tokenize(self, text):
+        """Return the words of a text, each keeping its trailing whitespace."""
+        return [word + " " for word in text.split()]
+
+    def detokenize(self, tokens):
+        """Return the text of a list of words."""
+        return "".join(tokens)
+
+class Request:
+    """A queued generation request and the event its client waits on."""
+
+    def __init__(self, prompt, priority):
+        self.prompt = prompt
+        self.priority = priority
+        self.queued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class InferenceServer:
+    """Serves one warm model to every pipeline stage over a local socket.
+
+    Clients send ``generate`` requests tagged with a priority; a single
+    worker thread takes up to ``max_batch`` of the most urgent queued
+    requests at a time and runs them on the backend. Tokenization is served
+    directly, since it only reads the model's vocabulary. ``stats`` reports
+    the model and its generation config, queue depth, batch sizes and
+    request latency percentiles.
+    """
+
+    def __init__(self, backend, address=ADDRESS, authkey=None, max_batch=8):
+        self.backend = backend
+        self.address = address
+        self.authkey = authkey or load_authkey(create=True)
+        self.max_batch = max_batch
+        self.queue = queue.PriorityQueue()
+        self.order = itertools.count()  # FIFO within a priority
+        self.latencies = deque(maxlen=10000)
+        self.completed = 0
+        self.batches = 0
+        self.started = time.monotonic()
+
+    def submit(self, prompt, priority=PRIORITY_BATCH):
+        """Queue a prompt and block until its completion is ready."""
+        request = Request(prompt, priority)
+        self.queue.put((priority, next(self.order), request))
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _work(self):
+        """Run queued requests on the backend, most urgent first, in batches."""
+        while True:
+            batch = [self.queue.get()[2]]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait()[2])
+                except queue.Empty:
+                    break
+            prompts = list(dict.fromkeys(request.prompt for request in batch))
+            failure = None
+            try:
+                results = dict(zip(prompts, self.backend.generate(prompts)))
+            except Exception as error:
+                results, failure = {}, error
+            now = time.monotonic()
+            for request in batch:
+                if request.prompt in results:
+                    request.result = results[request.prompt]
+                else:
+                    request.error = failure
+                self.latencies.append(now - request.queued)
+                request.done.set()
+            self.completed += len(batch)
+            self.batches += 1
+
+    def stats(self):
+        """Return the served model and generation config, queue depth, throughput and latency percentiles in seconds."""
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 3) if latencies else None
+
+        return {
+            "backend": self.backend.name,
+            "model": self.backend.model,
+            "config": self.backend.config,
+            "queue_depth": self.queue.qsize(),
+            "completed": self.completed,
+            "batches": self.batches,
+            "mean_batch": round(self.completed / self.batches, 2) if self.batches else None,
+            "latency_p50": percentile(50),
+            "latency_p95": percentile(95),
+            "latency_max": round(latencies[-1], 3) if latencies else None,
+            "uptime": round(time.monotonic() - self.started, 1)
+        }
+
+    def _serve(self, conn):
+        """Answer one client's requests until it disconnects."""
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    return
+                try:
+                    op = message["op"]
+                    if op == "generate":
+                        reply = {"result": self.submit(message["prompt"], message.get("priority", PRIORITY_BATCH))}
+                    elif op == "tokenize":
+                        reply = {"result": self.backend.tokenize(message["text"])}
+                    elif op == "detokenize":
+                        reply = {"result": self.backend.detokenize(message["tokens"])}
+                    elif op == "stats":
+                        reply = {"result": self.stats()}
+                    else:
+                        reply = {"error": f"Unknown op {op!r}"}
+                except Exception as error:
+                    reply = {"error": f"{type(error).__name__}: {error}"}
+                conn.send(reply)
+
+    def serve_forever(self):
+        """Accept clients on the local socket, one thread each."""
+        threading.Thread(target=self._work, daemon=True).start()
+        with Listener(self.address, backlog=64, authkey=self.authkey) as listener:
+            print(f"Inference server ({self.backend.name}: {self.backend.model}) listening on "
+                  f"{self.address[0]}:{self.address[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as error:
+                    print(f"Rejected connection: {type(error).__name__}: {error}")
+                    continue
+                threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+class InferenceClient:
+    """Connection to a running InferenceServer; one request at a time per client."""
+
+    def __init__(self, address=ADDRESS, authkey=None):
+        try:
+            self.conn = Client(address, authkey=authkey or load_authkey())
+        except ConnectionRefusedError:
+            raise ConnectionRefusedError(
+                f"No inference server on {address[0]}:{address[1]}; start it with: python inference_server.py"
+            ) from None
+        self.lock = threading.Lock()
+
+    def _call(self, **message):
+        with self.lock:
+            self.conn.send(message)
+            reply = self.conn.recv()
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply["result"]
+
+    def generate(self, prompt, priority=PRIORITY_BATCH):
+        """Return the model's completion of a prompt."""
+        return self._call(op="generate", prompt=prompt, priority=priority)
+
+    def tokenize(self, text, add_bos_token=False):
+        """Return the model's token ids for a text (never with a BOS token)."""
+        return self._call(op="tokenize", text=text)
+
+    def detokenize(self, tokens):
+        """Return the text of a list of token ids."""
+        return self._call(op="detokenize", tokens=list(tokens))
+
+    def stats(self):
+        """Return the server's queue and latency stats."""
+        return self._call(op="stats")
+
+    def close(self):
+        self.conn.close()
+
+class RemoteLLM(LLM):
+    """LangChain LLM backed by the shared inference server.
+
+    ``client`` mirrors the tokenize/detokenize methods of the ctransformers
+    model, so chunker.ctransformers_tokenizer works with it unchanged.
+    """
+
+    client: Any
+    model: str
+    config: Dict[str, Any] = {}
+    priority: int = PRIORITY_BATCH
+
+    @property
+    def _llm_type(self):
+        return "inference-server"
+
+    @property
+    def _identifying_params(self):
+        # The LLM cache keys on these, so responses stay tied to the served model and its sampling settings
+        return {"model": self.model, **self.config}
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return self.client.generate(prompt, self.priority)
+
+def connect_llm(priority=PRIORITY_BATCH, address=ADDRESS):
+    """Return a RemoteLLM talking to the inference server at ``address``."""
+    client = InferenceClient(address)
+    stats = client.stats()
+    return RemoteLLM(client=client, model=stats["model"], config=stats["config"], priority=priority)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the local llama model loaded and serve it to the pipeline.")
+    parser.add_argument("--backend", choices=["ctransformers", "stub"], default="ctransformers")
+    parser.add_argument("--model", default=MODEL_PATH, help="Path of the GGML model (or LLAMA_MODEL_PATH)")
+    parser.add_argument("--model-type", default="llama")
+    parser.add_argument("--max-new-tokens", type=int, default=512)
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--context-length", type=int, default=4096, help="Llama-2 context window in tokens")
+    parser.add_argument("--max-batch", type=int, default=8, help="Requests taken from the queue at once")
+    parser.add_argument("--port", type=int, default=ADDRESS[1])
+    parser.add_argument("--stub-delay", type=float, default=0.0, help="Seconds per prompt for the stub backend")
+    parser.add_argument("--stats", action="store_true", help="Print a running server's stats and exit")
+    args = parser.parse_args()
+
+    address = (ADDRESS[0], args.port)
+    if args.stats:
+        for key, value in InferenceClient(address).stats().items():
+            print(f"{key}: {value}")
+    else:
+        start = time.perf_counter()
+        if args.backend == "stub":
+            backend = StubBackend(args.stub_delay)
+        else:
+            backend = CTransformersBackend(args.model, args.model_type,
+                                           {'max_new_tokens': args.max_new_tokens, 'temperature': args.temperature,
+                                            'context_length': args.context_length})
+        print(f"Model loaded in {time.perf_counter() - start:.1f}s")
+        InferenceServer(backend, address, max_batch=args.max_batch).serve_forever()
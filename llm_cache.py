@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain.globals import set_llm_cache
+from langchain.load import dumps, loads
+from langchain.schema.cache import BaseCache
+from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+
+def cache_key(prompt, llm_string):
+    """Hash the rendered prompt together with the model's name, temperature and other settings."""
+    return hashlib.sha256(f"{llm_string}\0{prompt}".encode('utf-8')).hexdigest()
+
+def token_usage(generations):
+    """Return (model name, prompt tokens, completion tokens) reported by OpenAI for a response."""
+    metadata = getattr(getattr(generations[0], "message", None), "response_metadata", None) or {}
+    usage = metadata.get("token_usage") or {}
+    return metadata.get("model_name"), usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+class LLMResponseCache(BaseCache):
+    """Persistent LangChain LLM cache in SQLite, shared by every chain and model.
+
+    Responses are keyed by a hash of the rendered prompt and the LLM settings
+    (model name, temperature, ...), so identical calls are paid for once
+    across reruns. The least recently used entries are evicted once the
+    stored responses exceed ``max_bytes``. With ``bypass`` the cache is
+    neither read nor written. Hits also count the tokens and cost that the
+    original call used, which are the amounts get_openai_callback would have
+    reported without the cache.
+    """
+
+    def __init__(self, path=".llm_cache.sqlite", max_bytes=256 * 1024 * 1024, bypass=False):
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+        self.saved_cost = 0.0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                model_name TEXT,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def lookup(self, prompt, llm_string):
+        """Return the cached generations for this prompt and LLM, or None."""
+        if self.bypass:
+            return None
+        key = cache_key(prompt, llm_string)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, model_name, prompt_tokens, completion_tokens FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            response, model_name, prompt_tokens, completion_tokens = row
+            self.hits += 1
+            self.saved_prompt_tokens += prompt_tokens
+            self.saved_completion_tokens += completion_tokens
+            if model_name and (prompt_tokens or completion_tokens):
+                try:
+                    self.saved_cost += (get_openai_token_cost_for_model(model_name, prompt_tokens)
+                                        + get_openai_token_cost_for_model(model_name, completion_tokens, is_completion=True))
+                except ValueError:
+                    pass  # Not an OpenAI model with a known price
+        return [loads(generation) for generation in json.loads(response)]
+
+    def update(self, prompt, llm_string, return_val):
+        """Store the generations of a call that missed the cache."""
+        if self.bypass:
+            return
+        response = json.dumps([dumps(generation) for generation in return_val])
+        model_name, prompt_tokens, completion_tokens = token_usage(return_val)
+        size = len(response.encode('utf-8'))
+        key = cache_key(prompt, llm_string)
+        with self.lock:
+            # Concurrent misses on the same prompt store it twice; the replaced entry no longer counts
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, response, model_name, prompt_tokens, completion_tokens, size, time.time())
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache is back under its size limit."""
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+
+    def clear(self, **kwargs):
+        """Remove every cached response."""
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.total_bytes = 0
+
+    def report(self):
+        """Print the hit/miss counters and what the hits saved."""
+        print(f"LLM cache: {self.hits} hits, {self.misses} misses")
+        print(f"Saved tokens: {self.saved_prompt_tokens + self.saved_completion_tokens} "
+              f"(prompt {self.saved_prompt_tokens}, completion {self.saved_completion_tokens})")
+        print(f"Saved cost: {self.saved_cost}")
+
+def enable_llm_cache(path=None, bypass=None):
+    """Install the shared LLM cache for every LangChain model in this process.
+
+    Responses to identical prompts are then reused across reruns.
+    ``LLM_CACHE_PATH`` and ``LLM_CACHE_BYPASS=1`` (which disables the reuse)
+    in the environment override the defaults when the arguments are not given.
+    """
+    if path is None:
+        path = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite")
+    if bypass is None:
+        bypass = os.getenv("LLM_CACHE_BYPASS", "") not in ("", "0")
+    cache = LLMResponseCache(path, bypass=bypass)
+    set_llm_cache(cache)
+    return cache
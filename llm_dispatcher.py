@@ -0,0 +1,138 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+class TokenBucket:
+    """Async token bucket refilled continuously at ``per_minute`` tokens per minute."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        """Wait until ``amount`` tokens are available and take them; waiters are served in order."""
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+def status_code(error):
+    """Return the HTTP status carried by an API error, if any."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+def is_retryable(error):
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying."""
+    status = status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError)) or type(error).__name__ in (
+        "APIConnectionError", "APITimeoutError", "RateLimitError", "ServiceUnavailableError", "Timeout"
+    )
+
+def retry_after(error):
+    """Return the server's Retry-After delay in seconds, if it sent one."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def estimate_tokens(text, completion_tokens=256):
+    """Roughly estimate the tokens a call will use (about 4 characters per token)."""
+    return len(text) // 4 + completion_tokens
+
+class LLMDispatcher:
+    """Runs LLM calls concurrently under request and token rate limits.
+
+    ``workers`` calls run at once. Every call first takes one request from
+    the requests-per-minute bucket and its estimated tokens from the
+    tokens-per-minute bucket. Calls failing with 429, 5xx or connection
+    errors are retried up to ``max_retries`` times with exponential backoff
+    and full jitter (or the server's Retry-After delay), so the models it
+    drives should be built with their own retries off (``max_retries=0``).
+    ``latencies`` holds the duration of each successful call, without the
+    time spent waiting for the rate limits or between retries.
+    """
+
+    def __init__(self, workers=4, rpm=3500, tpm=90000, max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.workers = workers
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.retries = 0
+        self.completed = 0
+        self.elapsed = 0.0
+        self.latencies = []
+
+    async def call(self, make_call, tokens):
+        """Await ``make_call()`` under the rate limits, retrying transient failures."""
+        for attempt in range(self.max_retries + 1):
+            await self.requests.acquire(1)
+            await self.tokens.acquire(tokens)
+            self.calls += 1
+            start = time.monotonic()
+            try:
+                result = await make_call()
+                self.latencies.append(time.monotonic() - start)
+                return result
+            except Exception as error:
+                if attempt == self.max_retries or not is_retryable(error):
+                    raise
+                delay = retry_after(error)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                self.retries += 1
+                print(f"Retrying after {type(error).__name__} (status {status_code(error)}) in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def run(self, items, handler):
+        """Run ``handler(item)`` over the items concurrently, yielding ``(item, result)`` in input order.
+
+        Items are read lazily, at most a few per worker ahead of the oldest
+        unfinished one, so results can be written out as they complete.
+        """
+        start = time.monotonic()
+        semaphore = asyncio.Semaphore(self.workers)
+        window = deque()
+
+        async def work(item):
+            async with semaphore:
+                return await handler(item)
+
+        try:
+            for item in items:
+                window.append((item, asyncio.ensure_future(work(item))))
+                while len(window) > self.workers * 4:
+                    item, task = window.popleft()
+                    yield item, await task
+                    self.completed += 1
+            while window:
+                item, task = window.popleft()
+                yield item, await task
+                self.completed += 1
+        finally:
+            for _, task in window:
+                task.cancel()
+            self.elapsed += time.monotonic() - start
+
+    def report(self):
+        """Print throughput and retry counts."""
+        rate = self.completed / self.elapsed * 60 if self.elapsed else 0.0
+        print(f"Dispatcher: {self.completed} pages in {self.elapsed:.1f}s ({rate:.1f} pages/min), "
+              f"{self.calls} LLM calls, {self.retries} retries, {self.workers} workers")
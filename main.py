@@ -1,30 +1,227 @@
+import argparse
+import hashlib
+import json
+import os
+import runpy
 import subprocess
 import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from modulefinder import ModuleFinder
 
-def run_command(command):
-    """Run a shell command and check for errors."""
-    print(f"Running command: {command}")
-    result = subprocess.run(command, shell=True, text=True, capture_output=True)
-    if result.returncode != 0:
-        print(f"Error running command: {result.stderr}")
-        sys.exit(result.returncode)
-    print(f"Command output: {result.stdout}")
+from checkpoint import write_atomic
+from page_store import EXPORTS
+
+# A pipeline step: the script it runs, its arguments and the files it reads and writes.
+# ``volatile`` stages read something outside the tree (the live site) and always run;
+# stages that are not ``default`` only run when selected with --only or --from.
+Stage = namedtuple("Stage", ["name", "script", "args", "inputs", "outputs", "volatile", "default"])
+
+STAGES = [
+    Stage("crawl", "a_tag.py", ["--output", "output1.jsonl", "--anchors-output", "output2.jsonl",
+                                "--cache", ".http_cache.sqlite", "--template-blocks"],
+          [], ["output1.jsonl", "output2.jsonl"], True, True),
+    # Menus, headers and footers repeated across the site are cut before any model sees the text
+    Stage("template", "boilerplate.py", ["--input", "output1.jsonl", "--output", "output1_stripped.jsonl"],
+          ["output1.jsonl"], ["output1_stripped.jsonl"], False, True),
+    Stage("anchors", "merge.py", ["--pages", "output1_stripped.jsonl"], ["output1_stripped.jsonl", "output2.jsonl"],
+          ["final_output.jsonl"], False, True),
+    Stage("dedupe", "dedupe.py", [], ["final_output.jsonl"], ["duplicates.json"], False, True),
+    Stage("questions", "question_generator.py", [], ["final_output.jsonl", "duplicates.json"],
+          ["generated_questions1.jsonl"], False, True),
+    Stage("links", "relevant_link.py", [], ["generated_questions1.jsonl", "final_output.jsonl"],
+          ["final_output_with_relevant_links.json"], False, True),
+    Stage("merge", "merge2.py", [], ["final_output.jsonl", "final_output_with_relevant_links.json"],
+          ["merged_output.json"], False, True),
+    Stage("evaluate", "evaluation.py", [], ["merged_output.json"], ["evaluation_results.jsonl"], False, True),
+    # Needs a running inference_server.py
+    Stage("answers", "answer.py", [], ["generated_questions1.jsonl", "output1.jsonl"],
+          ["output_answers.json"], False, False),
+]
+
+STORE = "pages.sqlite"
+
+# The same pipeline on the page store (--store): stages read and update rows instead of whole files.
+# Their "<store>:<table>" inputs and outputs only order the stages; each stage skips unchanged rows
+# itself, so all of them are volatile.
+STORE_STAGES = [
+    Stage("crawl", "a_tag.py", ["--store", STORE, "--cache", ".http_cache.sqlite", "--template-blocks"],
+          [], [f"{STORE}:pages"], True, True),
+    Stage("template", "boilerplate.py", ["--store", STORE], [f"{STORE}:pages"], [f"{STORE}:stripped_pages"],
+          True, True),
+    Stage("dedupe", "dedupe.py", ["--store", STORE], [f"{STORE}:stripped_pages"], ["duplicates.json"], True, True),
+    Stage("questions", "question_generator.py", ["--store", STORE], [f"{STORE}:stripped_pages", "duplicates.json"],
+          [f"{STORE}:questions"], True, True),
+    Stage("links", "relevant_link.py", ["--store", STORE], [f"{STORE}:questions"], [f"{STORE}:links"], True, True),
+    Stage("evaluate", "evaluation.py", ["--store", STORE], [f"{STORE}:links"], [f"{STORE}:evaluations"], True, True),
+    # The legacy files, for tools that still read them
+    Stage("export", "page_store.py", ["export", "--store", STORE], [f"{STORE}:evaluations"],
+          [path for path, _ in EXPORTS.values()], True, True),
+]
+
+STATE_FILE = ".pipeline_state.json"
+
+class ThreadArgv(list):
+    """sys.argv replacement holding a separate argument list per thread, so stages can run side by side."""
+
+    def __init__(self, default):
+        super().__init__(default)
+        self.local = threading.local()
+
+    def current(self):
+        return getattr(self.local, "argv", None) or list.__iter__(self)
+
+    def __getitem__(self, index):
+        return list(self.current())[index]
+
+    def __iter__(self):
+        return iter(list(self.current()))
+
+    def __len__(self):
+        return len(list(self.current()))
+
+def file_hash(path):
+    """Return the SHA-256 of a file's contents, or None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def local_modules(script):
+    """Return the paths of this repository's modules that a script imports, directly or through others.
+
+    Imports are read from the code rather than recorded while the script
+    runs, so imports inside functions count and stages running side by side
+    do not mix.
+    """
+    finder = ModuleFinder(path=[os.path.dirname(os.path.abspath(script))])
+    finder.run_script(script)
+    return sorted(os.path.relpath(module.__file__) for name, module in finder.modules.items()
+                  if module.__file__ and name != "__main__")
+
+def fingerprint(stage):
+    """Hash the stage's script and the local modules it imports, its arguments and input files."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([stage.script, file_hash(stage.script), stage.args]).encode('utf-8'))
+    for path in local_modules(stage.script):
+        digest.update(f"{path}\0{file_hash(path)}\0".encode('utf-8'))
+    for path in stage.inputs:
+        digest.update(f"{path}\0{file_hash(path)}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+def is_current(stage, state):
+    """Return whether the stage already ran on these inputs and its outputs are untouched since."""
+    previous = state.get(stage.name)
+    if stage.volatile or previous is None or previous["fingerprint"] != fingerprint(stage):
+        return False
+    return all(file_hash(path) == digest for path, digest in previous["outputs"].items())
+
+def run_stage(stage):
+    """Run a stage's script in this process, as if started with ``python script args``."""
+    sys.argv.local.argv = [stage.script] + stage.args
+    try:
+        runpy.run_path(stage.script, run_name="__main__")
+    except SystemExit as exit:
+        if exit.code not in (None, 0):
+            raise RuntimeError(f"{stage.script} exited with status {exit.code}")
+    finally:
+        sys.argv.local.argv = None
+
+def select(names_only, name_from, stages=STAGES):
+    """Return the stages to run, in declaration order."""
+    if names_only:
+        names = set(names_only.split(','))
+        unknown = names - {stage.name for stage in stages}
+        if unknown:
+            sys.exit(f"Unknown stages: {', '.join(sorted(unknown))}")
+        return [stage for stage in stages if stage.name in names]
+    start = 0
+    if name_from:
+        start = next((i for i, stage in enumerate(stages) if stage.name == name_from), None)
+        if start is None:
+            sys.exit(f"Unknown stage: {name_from}")
+    return [stage for i, stage in enumerate(stages) if i >= start and (stage.default or stage.name == name_from)]
+
+def run_pipeline(stages, jobs=2, force=False):
+    """Run the selected stages, skipping up-to-date ones and running independent ones concurrently."""
+    state = {}
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, 'r') as f:
+            state = json.load(f)
+    # A stage waits for the selected stages that write any of its inputs
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+    waits_for = {stage.name: {producers[path] for path in stage.inputs if path in producers} - {stage.name}
+                 for stage in stages}
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+    done, failed = set(), set()
+    lock = threading.Lock()
+
+    def execute(stage):
+        if not force and is_current(stage, state):
+            print(f"[{stage.name}] up to date, skipped")
+            return "skipped"
+        print(f"[{stage.name}] running {stage.script} {' '.join(stage.args)}")
+        start = time.perf_counter()
+        run_stage(stage)
+        with lock:
+            state[stage.name] = {"fingerprint": fingerprint(stage),
+                                 "outputs": {path: file_hash(path) for path in stage.outputs}}
+            write_atomic(STATE_FILE, json.dumps(state, indent=4))
+        print(f"[{stage.name}] finished in {time.perf_counter() - start:.1f}s")
+        return "ran"
+
+    argv, sys.argv = sys.argv, ThreadArgv(sys.argv)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in [name for name in pending if waits_for[name] & failed]:
+                print(f"[{name}] not run: depends on a failed stage")
+                failed.add(name)
+                del pending[name]
+            for name in [name for name in pending if waits_for[name] <= done]:
+                running[pool.submit(execute, pending.pop(name))] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    done.add(name)
+                except Exception as error:
+                    print(f"[{name}] failed: {type(error).__name__}: {error}")
+                    failed.add(name)
+    sys.argv = argv
+    return not failed
 
 def main():
-    # Install packages from requirements.txt
-    run_command('pip install -r requirement.txt')
-    
-    # Run the Python scripts in the specified order
-    scripts = [
-        'a_tag.py',
-        'anchor.py',
-        'merge.py',
-        'question_generator.py',
-        'relevant_link.py'
-    ]
-    
-    for script in scripts:
-        run_command(f'python {script}')
+    parser = argparse.ArgumentParser(description="Run the crawl-to-evaluation pipeline.")
+    parser.add_argument("--only", help="Comma-separated stages to run, e.g. questions,links")
+    parser.add_argument("--from", dest="start", help="Run this stage and every default stage after it")
+    parser.add_argument("--force", action="store_true", help="Run stages even when their inputs are unchanged")
+    parser.add_argument("--jobs", type=int, default=2, help="Independent stages run at the same time")
+    parser.add_argument("--install", action="store_true", help="pip install -r requirement.txt first")
+    parser.add_argument("--list", action="store_true", help="List the stages and exit")
+    parser.add_argument("--store", action="store_true", help=f"Keep pages and results in {STORE} instead of JSON files")
+    args = parser.parse_args()
+    stages = STORE_STAGES if args.store else STAGES
+
+    if args.list:
+        for stage in stages:
+            flag = "" if stage.default else "  (only when selected)"
+            print(f"{stage.name:10s} {stage.script:24s} {', '.join(stage.inputs) or '-'} -> {', '.join(stage.outputs)}{flag}")
+        return
+
+    if args.install:
+        subprocess.run([sys.executable, "-m", "pip", "install", "-r", "requirement.txt"], check=True)
+
+    if not run_pipeline(select(args.only, args.start, stages), args.jobs, args.force):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
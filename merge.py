@@ -1,38 +1,62 @@
-import json
+import argparse
+from records import read_records, write_records
+from frontier import canonicalize_url
+from external_sort import ExternalSorter, merge_join, peak_rss_mb
 
-def load_json(filename):
-    """Load JSON data from a file."""
-    with open(filename, 'r') as f:
-        return json.load(f)
-
-def save_json(data, filename):
-    """Save JSON data to a file."""
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=4)
-
-def update_anchor_texts(first_file, second_file, output_file):
-    """Update anchor texts in the first JSON file based on the second JSON file."""
-    # Load data from JSON files
-    first_data = load_json(first_file)
-    second_data = load_json(second_file)
-
-    # Create a dictionary mapping URLs to their anchor texts from the second file
-    anchor_map = {item['url']: item['title'] for item in second_data}
-    
-    # Update the anchor texts in the first file's data
-    for item in first_data:
+def apply_anchor_titles(pages, anchor_map):
+    """Yield page records with their titles replaced by the anchor text that links to them."""
+    for item in pages:
         url = item['url']
         if url in anchor_map:
             item['title'] = anchor_map[url]
+        yield item
 
-    # Save the updated data to a new JSON file
-    save_json(first_data, output_file)
+def update_anchor_texts(first_file, second_file, output_file):
+    """Update anchor texts in the first file based on the second file."""
+    # Create a dictionary mapping URLs to their anchor texts from the second file
+    anchor_map = {item['url']: item['title'] for item in read_records(second_file)}
+
+    # Stream the pages of the first file through to the output file
+    write_records(apply_anchor_titles(read_records(first_file), anchor_map), output_file)
     print(f"Updated data saved to {output_file}")
 
-# Define file paths
-first_file = 'output1.json'  # Replace with your first JSON file path
-second_file = 'output2.json'  # Replace with your second JSON file path
-output_file = 'final_output.json'  # Output file for the updated data
+def update_anchor_texts_out_of_core(first_file, second_file, output_file, memory_mb=256):
+    """Update anchor texts like update_anchor_texts, holding at most about ``memory_mb`` of records.
+
+    Pages and anchors are sorted by canonical URL on disk and merge-joined,
+    so ``http``/``https`` and trailing-slash variants of a URL also match.
+    The last anchor text of a URL wins, and pages keep their input order.
+    """
+    memory = (memory_mb << 20) // 3  # The output sort fills its buffer while both inputs still hold theirs
+    with ExternalSorter(memory) as pages, ExternalSorter(memory) as anchors, ExternalSorter(memory) as output:
+        for seq, item in enumerate(read_records(first_file)):
+            pages.add(canonicalize_url(item['url']), [seq, item])
+        for item in read_records(second_file):
+            anchors.add(canonicalize_url(item['url']), item['title'])
+
+        for _, page_group, titles in merge_join(pages, anchors):
+            for seq, item in page_group:
+                if titles:
+                    item['title'] = titles[-1]
+                output.add(seq, item)
+        count = write_records((item for _, item in output), output_file)
+        spilled = pages.spilled + anchors.spilled + output.spilled
+        passes = pages.merge_passes + anchors.merge_passes + output.merge_passes
+    print(f"Updated data saved to {output_file}: {count} pages, {spilled} sorted runs spilled to disk, "
+          f"{passes} merge passes, peak RSS {peak_rss_mb() or 0:.0f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Title each crawled page by the anchor text that links to it.")
+    parser.add_argument("--pages", default='output1.jsonl', help="Page records")
+    parser.add_argument("--anchors", default='output2.jsonl', help="Anchor records")
+    parser.add_argument("--output", default='final_output.jsonl', help="Output file for the updated data")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="Join on disk by canonical URL instead of holding the anchors in memory")
+    parser.add_argument("--memory-mb", type=int, default=256, help="Memory ceiling of the out-of-core join")
+    args = parser.parse_args()
 
-# Run the update function
-update_anchor_texts(first_file, second_file, output_file)
+    # Run the update function
+    if args.out_of_core:
+        update_anchor_texts_out_of_core(args.pages, args.anchors, args.output, args.memory_mb)
+    else:
+        update_anchor_texts(args.pages, args.anchors, args.output)
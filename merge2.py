@@ -1,51 +1,87 @@
-import json
+import argparse
+from records import read_records, write_records
+from frontier import canonicalize_url
+from external_sort import ExternalSorter, merge_join, peak_rss_mb
 
-def load_json(filename):
-    """Load JSON data from a file."""
-    with open(filename, 'r') as file:
-        return json.load(file)
+def merge_records(content_records, links_dict):
+    """Yield content records joined with their links and questions, then link-only records.
 
-def save_json(data, filename):
-    """Save JSON data to a file."""
-    with open(filename, 'w') as file:
-        json.dump(data, file, indent=4)
+    ``links_dict`` maps URLs to link records; it is consumed as it is joined.
+    """
+    for entry in content_records:
+        links_entry = links_dict.pop(entry['url'], None)
+        if links_entry is not None:
+            entry['relevant_links'] = links_entry.get('relevant_links', [])
+            entry['questions'] = links_entry.get('questions', [])
+        yield entry
+
+    for url, entry in links_dict.items():
+        yield link_only_record(url, entry)
+
+def link_only_record(url, entry):
+    """Return the merged record of a URL that has links but no content."""
+    return {
+        'url': url,
+        'content': '',
+        'title': '',
+        'relevant_links': entry.get('relevant_links', []),
+        'questions': entry.get('questions', [])
+    }
 
 def merge_json_files(content_file, links_file, output_file):
-    """Merge the content and links from two JSON files into one."""
-    content_data = load_json(content_file)
-    links_data = load_json(links_file)
-
-    # Create a dictionary for quick lookup
-    content_dict = {entry['url']: entry for entry in content_data}
-    
-    # Merge data
-    for entry in links_data:
-        url = entry['url']
-        if url in content_dict:
-            content_dict[url]['relevant_links'] = entry.get('relevant_links', [])
-            content_dict[url]['questions'] = entry.get('questions', [])
-        else:
-            content_dict[url] = {
-                'url': url,
-                'content': '',
-                'title': '',
-                'relevant_links': entry.get('relevant_links', []),
-                'questions': entry.get('questions', [])
-            }
-    
+    """Merge the content and links from two files into one."""
+    # Only the (much smaller) links side is held in memory; content is streamed
+    links_dict = {entry['url']: entry for entry in read_records(links_file)}
+
     # Save the merged data
-    merged_data = list(content_dict.values())
-    save_json(merged_data, output_file)
+    write_records(merge_records(read_records(content_file), links_dict), output_file)
+
+def merge_json_files_out_of_core(content_file, links_file, output_file, memory_mb=256):
+    """Merge like merge_json_files, holding at most about ``memory_mb`` of records.
+
+    Both files are sorted by canonical URL on disk and merge-joined. As in
+    the in-memory merge, the last links record of a URL is joined to the
+    first page with that URL, and links without a page follow the pages.
+    """
+    memory = (memory_mb << 20) // 3  # The output sort fills its buffer while both inputs still hold theirs
+    with ExternalSorter(memory) as contents, ExternalSorter(memory) as links, ExternalSorter(memory) as output:
+        for seq, entry in enumerate(read_records(content_file)):
+            contents.add(canonicalize_url(entry['url']), [seq, entry])
+        for seq, entry in enumerate(read_records(links_file)):
+            links.add(canonicalize_url(entry['url']), [seq, entry])
+
+        for _, content_group, links_group in merge_join(contents, links):
+            links_entry = links_group[-1][1] if links_group else None
+            for i, (seq, entry) in enumerate(content_group):
+                if i == 0 and links_entry is not None:
+                    entry['relevant_links'] = links_entry.get('relevant_links', [])
+                    entry['questions'] = links_entry.get('questions', [])
+                output.add([0, seq], entry)
+            if links_group and not content_group:
+                first_seq, first_entry = links_group[0]
+                output.add([1, first_seq], link_only_record(first_entry['url'], links_entry))
+        count = write_records((entry for _, entry in output), output_file)
+        spilled = contents.spilled + links.spilled + output.spilled
+        passes = contents.merge_passes + links.merge_passes + output.merge_passes
+    print(f"{count} records merged, {spilled} sorted runs spilled to disk, {passes} merge passes, "
+          f"peak RSS {peak_rss_mb() or 0:.0f} MB")
 
 def main():
-    # Define file names
-    final_output_file = 'final_output.json'
-    final_output_links_file = 'final_output_with_relevant_links.json'
-    merged_output_file = 'merged_output.json'
-    
+    parser = argparse.ArgumentParser(description="Join the crawled content with its questions and relevant links.")
+    parser.add_argument("--content", default='final_output.jsonl', help="Content file")
+    parser.add_argument("--links", default='final_output_with_relevant_links.json', help="Questions and links file")
+    parser.add_argument("--output", default='merged_output.json', help="Merged output file")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="Join on disk by canonical URL instead of holding the links in memory")
+    parser.add_argument("--memory-mb", type=int, default=256, help="Memory ceiling of the out-of-core join")
+    args = parser.parse_args()
+
     # Merge JSON files
-    merge_json_files(final_output_file, final_output_links_file, merged_output_file)
-    print(f"Merged data saved to {merged_output_file}")
+    if args.out_of_core:
+        merge_json_files_out_of_core(args.content, args.links, args.output, args.memory_mb)
+    else:
+        merge_json_files(args.content, args.links, args.output)
+    print(f"Merged data saved to {args.output}")
 
 if __name__ == "__main__":
     main()
@@ -1,23 +1,15 @@
-import json
-from langchain_community.llms import CTransformers
+import time
 from langchain.prompts import PromptTemplate
+from records import read_records, write_records, RecordWriter
+from dedupe import ClusterFanOut, load_duplicates
+from llm_cache import enable_llm_cache
+from chunker import chunk_text, ctransformers_tokenizer, salience_order
+from inference_server import connect_llm, PRIORITY_BATCH
 
-# Load the JSON file containing content
-def load_json(file_path):
-    with open(file_path, 'r') as f:
-        return json.load(f)
+llm_cache = enable_llm_cache()
 
-# Save the results in the specified format
-def save_json(data, file_path):
-    with open(file_path, 'w') as f:
-        json.dump(data, f, indent=4)
-
-# Initialize the language model
-llm = CTransformers(
-    model="/Users/pratyushgupta/Desktop/overlayy_PS_OOSC--master/llama-2-7b-chat.ggmlv3.q4_0.bin",
-    model_type="llama",
-    config={'max_new_tokens': 512, 'temperature': 0.8}
-)
+# Use the llama model kept warm by inference_server.py, shared with answer.py
+llm = connect_llm(priority=PRIORITY_BATCH)
 
 # Define the prompt template for question generation
 question_generation_prompt = """
@@ -30,61 +22,79 @@ Questions:
 
 prompt_template = PromptTemplate(template=question_generation_prompt, input_variables=["content"])
 
-# Function to split content into chunks and halve the content size
-def split_content(content, max_tokens=256):  # Halved token limit
-    words = content.split()
-    chunks = []
-    current_chunk = []
-
-    for word in words:
-        # Estimate token count for the current chunk + new word
-        estimated_tokens = len(" ".join(current_chunk + [word]).split())
-
-        if estimated_tokens <= max_tokens:
-            current_chunk.append(word)
-        else:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [word]
-
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-
-    return chunks
+# Chunks are measured in llama tokens so prompt + chunk + answer stay inside the model's context
+tokenizer = ctransformers_tokenizer(llm)
+CHUNK_TOKENS = 256  # Halved token limit
+CHUNK_OVERLAP = 16
+QUESTION_QUOTA = 10
 
-# Load content data from JSON
-content_data = load_json('final_output.json')  # Path to your input JSON file
+# Per-page generation stats, one record per page the model actually ran on
+stats_writer = RecordWriter('generation_stats2.jsonl')
+totals = {"pages": 0, "chunks_processed": 0, "chunks_skipped": 0, "seconds": 0.0, "seconds_saved": 0.0}
 
-# Create a list to store the results
-result_data = []
-
-# Process each URL and content
-for item in content_data:
-    url = item['url']
+# Generate questions for one page's content
+def questions_for(item):
     content = item['content']
 
     # Split content into chunks to avoid exceeding context length, halving content size
-    content_chunks = split_content(content, max_tokens=256)
+    content_chunks = chunk_text(content, CHUNK_TOKENS, overlap=CHUNK_OVERLAP, tokenizer=tokenizer)
 
+    # Visit the densest chunks first and stop once the quota is met
+    start = time.perf_counter()
     questions = []
-    for chunk in content_chunks:
+    processed = 0
+    for index in salience_order(content_chunks):
+        if len(questions) >= QUESTION_QUOTA:
+            break
         # Generate questions using the model
-        prompt_input = prompt_template.format(content=chunk)
+        prompt_input = prompt_template.format(content=content_chunks[index])
         generated_output = llm.invoke(prompt_input)  # Use 'invoke' instead of '__call__'
+        processed += 1
 
         # Split the generated output into individual questions
         chunk_questions = [q.strip() for q in generated_output.split('\n') if q.strip()]
         questions.extend(chunk_questions)
 
-    # Ensure only 10 questions are stored
-    questions = questions[:10]
-
-    # Store the results for this URL in the required format
-    result_data.append({
-        "url": url,
-        "questions": [f"{i+1}. {question}" for i, question in enumerate(questions)]
+    # Skipped chunks would have cost about as much as the ones that ran
+    elapsed = time.perf_counter() - start
+    skipped = len(content_chunks) - processed
+    saved = elapsed / processed * skipped if processed else 0.0
+    stats_writer.write({
+        "url": item['url'],
+        "chunks": len(content_chunks),
+        "chunks_processed": processed,
+        "chunks_skipped": skipped,
+        "seconds": round(elapsed, 3),
+        "seconds_saved": round(saved, 3)
     })
+    totals["pages"] += 1
+    totals["chunks_processed"] += processed
+    totals["chunks_skipped"] += skipped
+    totals["seconds"] += elapsed
+    totals["seconds_saved"] += saved
 
-# Save the generated questions to a new JSON file
-save_json(result_data, 'generated_questions2.json')
-
-print("Questions generated and saved to generated_questions2.json.")
+    # Ensure only 10 questions are stored
+    return questions[:QUESTION_QUOTA]
+
+# Generate questions for each page as it is read, once per near-duplicate cluster
+def generate_questions(content_data, fan_out):
+    for item, questions in fan_out.run(content_data, questions_for):
+        # Yield the results for this URL in the required format
+        yield {
+            "url": item['url'],
+            "questions": [f"{i+1}. {question}" for i, question in enumerate(questions)]
+        }
+
+fan_out = ClusterFanOut(load_duplicates('duplicates.json'))
+
+# Stream content from the input file into the generated questions file
+content_data = read_records('final_output.jsonl')  # Path to your input file
+write_records(generate_questions(content_data, fan_out), 'generated_questions2.jsonl')
+stats_writer.close()
+print(f"Early exit: {totals['chunks_processed']} chunks run, {totals['chunks_skipped']} skipped over "
+      f"{totals['pages']} pages; {totals['seconds']:.1f}s spent, ~{totals['seconds_saved']:.1f}s saved "
+      f"(per-page stats in generation_stats2.jsonl)")
+fan_out.report()
+llm_cache.report()
+
+print("Questions generated and saved to generated_questions2.jsonl.")
@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import sqlite3
+from collections.abc import Mapping
+
+from records import read_records, write_records
+from incremental import page_hash
+from merge2 import link_only_record
+
+# Tables holding one JSON record per page, written by the generation stages
+RECORD_TABLES = ("questions", "links", "evaluations")
+
+# Legacy files produced by ``python page_store.py export``: name -> (default path, PageStore method)
+EXPORTS = {
+    "output1": ("output1.jsonl", "raw_pages"),
+    "output2": ("output2.jsonl", "anchors"),
+    "final_output": ("final_output.jsonl", "pages"),
+    "questions": ("generated_questions1.jsonl", "questions"),
+    "links": ("final_output_with_relevant_links.json", "links"),
+    "merged": ("merged_output.json", "merged"),
+    "evaluations": ("evaluation_results.jsonl", "evaluations"),
+}
+
+# Titles a page by the last anchor text seen linking to it, as merge.py does
+LAST_ANCHOR = "LEFT JOIN anchors a ON a.rowid = (SELECT MAX(rowid) FROM anchors WHERE url = p.url)"
+
+class TableView(Mapping):
+    """Read-only mapping from URL to the records of one table, queried on access."""
+
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+
+    def __getitem__(self, url):
+        row = self.store.conn.execute(f"SELECT data FROM {self.table} WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            raise KeyError(url)
+        return json.loads(row[0])
+
+    def __iter__(self):
+        for (url,) in self.store.conn.execute(f"SELECT url FROM {self.table} ORDER BY rowid").fetchall():
+            yield url
+
+    def __len__(self):
+        return self.store.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+class TableWriter:
+    """Writes records into one table of the store, with the same interface as RecordWriter."""
+
+    def __init__(self, store, table, commit_every=100):
+        self.store = store
+        self.table = table
+        self.commit_every = commit_every
+        self.count = 0
+
+    def write(self, record):
+        """Insert or replace the record of one page."""
+        self.store.put(self.table, record)
+        self.count += 1
+        if self.count % self.commit_every == 0:
+            self.store.conn.commit()
+
+    def close(self):
+        self.store.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class PageStore:
+    """SQLite store of everything the pipeline knows about each page.
+
+    ``pages`` and ``anchors`` hold the crawl; ``questions``, ``links`` and
+    ``evaluations`` hold one JSON record per page. Anchors are kept per
+    source page, every anchor record of the crawl; the other tables are
+    keyed by URL and indexed by the hash of the page content the row was
+    made from, so stages look up and replace single rows instead of
+    rewriting files.
+    Anchor titles are applied to pages when they are read, which is what
+    merge.py did, and merged() joins the tables as merge2.py did. Pages
+    crawled with ``--template-blocks`` keep their text blocks until
+    ``boilerplate.py --store`` cuts the site template from them. Rows of
+    pages that a finished crawl no longer found are deleted from every
+    table. Rows keep their insertion order, so exports match the files the
+    stages used to write.
+    """
+
+    def __init__(self, path="pages.sqlite"):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")  # Readers do not block the stage that is writing
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                title TEXT,
+                content TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                crawl INTEGER NOT NULL,
+                blocks TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pages_hash ON pages (content_hash);
+            CREATE TABLE IF NOT EXISTS anchors (
+                source TEXT NOT NULL,
+                url TEXT NOT NULL,
+                title TEXT,
+                crawl INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        # Stores created before pages kept their text blocks
+        if "blocks" not in {column[1] for column in self.conn.execute("PRAGMA table_info(pages)")}:
+            self.conn.execute("ALTER TABLE pages ADD COLUMN blocks TEXT")
+        # Stores created before anchors were kept per source page held one per URL; their source is unknown
+        if "source" not in {column[1] for column in self.conn.execute("PRAGMA table_info(anchors)")}:
+            self.conn.executescript("""
+                ALTER TABLE anchors RENAME TO anchors_by_url;
+                CREATE TABLE anchors (source TEXT NOT NULL, url TEXT NOT NULL, title TEXT, crawl INTEGER NOT NULL);
+                INSERT INTO anchors SELECT '', url, title, crawl FROM anchors_by_url ORDER BY rowid;
+                DROP TABLE anchors_by_url;
+            """)
+        self.conn.executescript("""
+            CREATE INDEX IF NOT EXISTS anchors_source ON anchors (source);
+            CREATE INDEX IF NOT EXISTS anchors_url ON anchors (url);
+        """)
+        for table in RECORD_TABLES:
+            self.conn.executescript(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    url TEXT PRIMARY KEY,
+                    content_hash TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS {table}_hash ON {table} (content_hash);
+            """)
+        self.conn.commit()
+        self.crawl = None
+
+    # Crawl
+
+    def begin_crawl(self):
+        """Start a crawl; pages and anchors not written again before end_crawl() are then deleted."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'crawl'").fetchone()
+        self.crawl = int(row[0]) + 1 if row else 1
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('crawl', ?)", (str(self.crawl),))
+        self.conn.commit()
+
+    def put_page(self, record):
+        """Insert or update a crawled page record (``url``, ``content``, ``title`` and optionally ``blocks``)."""
+        blocks = json.dumps(record['blocks']) if 'blocks' in record else None
+        self.conn.execute(
+            """INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (url) DO UPDATE SET title = excluded.title, content = excluded.content,
+                   content_hash = excluded.content_hash, crawl = excluded.crawl, blocks = excluded.blocks""",
+            (record['url'], record.get('title'), record['content'], page_hash(record['content']), self.crawl or 0,
+             blocks)
+        )
+
+    def put_anchors(self, source, records):
+        """Replace the anchor records (``url``, ``title``) found on the page ``source``."""
+        self.conn.execute("DELETE FROM anchors WHERE source = ?", (source,))
+        self.conn.executemany("INSERT INTO anchors VALUES (?, ?, ?, ?)",
+                              ((source, record['url'], record['title'], self.crawl or 0) for record in records))
+
+    def end_crawl(self):
+        """Delete pages the crawl did not find again, and everything generated from them; return the count."""
+        deleted = self.conn.execute("DELETE FROM pages WHERE crawl < ?", (self.crawl,)).rowcount
+        self.conn.execute("DELETE FROM anchors WHERE crawl < ?", (self.crawl,))
+        self.drop_orphans()
+        self.conn.commit()
+        return deleted
+
+    def drop_orphans(self):
+        """Delete generated rows whose page is no longer in the store."""
+        for table in RECORD_TABLES:
+            self.conn.execute(f"DELETE FROM {table} WHERE url NOT IN (SELECT url FROM pages)")
+
+    # Reads
+
+    def raw_pages(self):
+        """Yield the crawled page records with the titles found on the pages themselves, and any text blocks."""
+        for url, content, title, blocks in self.conn.execute(
+                "SELECT url, content, title, blocks FROM pages ORDER BY rowid"):
+            record = {"url": url, "content": content, "title": title}
+            if blocks is not None:
+                record["blocks"] = json.loads(blocks)
+            yield record
+
+    def pages_with_blocks(self, batch_size=500):
+        """Yield the raw page records whose text blocks are still kept, i.e. whose template is not cut yet.
+
+        Rows are fetched in batches, so put_content() may be called while iterating.
+        """
+        last = 0
+        while True:
+            rows = self.conn.execute(
+                """SELECT rowid, url, content, title, blocks FROM pages
+                   WHERE rowid > ? AND blocks IS NOT NULL ORDER BY rowid LIMIT ?""", (last, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            for _, url, content, title, blocks in rows:
+                yield {"url": url, "content": content, "title": title, "blocks": json.loads(blocks)}
+            last = rows[-1][0]
+
+    def pages(self):
+        """Yield the page records titled by the anchor text that links to them, if any."""
+        query = f"SELECT p.url, p.content, COALESCE(a.title, p.title) FROM pages p {LAST_ANCHOR} ORDER BY p.rowid"
+        for url, content, title in self.conn.execute(query):
+            yield {"url": url, "content": content, "title": title}
+
+    def anchors(self):
+        """Yield the anchor records of the crawl in the order they were found."""
+        for url, title in self.conn.execute("SELECT url, title FROM anchors ORDER BY rowid"):
+            yield {"url": url, "title": title}
+
+    def content_hashes(self):
+        """Return the content hash of every page, by URL."""
+        return dict(self.conn.execute("SELECT url, content_hash FROM pages"))
+
+    def table(self, name):
+        """Return a read-only URL -> record mapping over one of RECORD_TABLES."""
+        return TableView(self, name)
+
+    def records(self, table):
+        """Yield the records of one of RECORD_TABLES in insertion order."""
+        for (data,) in self.conn.execute(f"SELECT data FROM {table} ORDER BY rowid"):
+            yield json.loads(data)
+
+    def questions(self):
+        return self.records("questions")
+
+    def links(self):
+        return self.records("links")
+
+    def evaluations(self):
+        return self.records("evaluations")
+
+    def merged(self):
+        """Yield each page joined with its links record (which carries the questions), like merge2.py.
+
+        As there, links records without a page follow the pages; drop_orphans()
+        normally leaves none.
+        """
+        query = f"""SELECT p.url, p.content, COALESCE(a.title, p.title), l.data FROM pages p {LAST_ANCHOR}
+                    LEFT JOIN links l ON l.url = p.url ORDER BY p.rowid"""
+        for url, content, title, links in self.conn.execute(query):
+            entry = {"url": url, "content": content, "title": title}
+            if links is not None:
+                links = json.loads(links)
+                entry['relevant_links'] = links.get('relevant_links', [])
+                entry['questions'] = links.get('questions', [])
+            yield entry
+        query = "SELECT url, data FROM links WHERE url NOT IN (SELECT url FROM pages) ORDER BY rowid"
+        for url, links in self.conn.execute(query):
+            yield link_only_record(url, json.loads(links))
+
+    # Writes
+
+    def put_content(self, url, content):
+        """Replace a page's content, e.g. with the text left after cutting the template, and drop its blocks."""
+        self.conn.execute("UPDATE pages SET content = ?, content_hash = ?, blocks = NULL WHERE url = ?",
+                          (content, page_hash(content), url))
+
+    def put(self, table, record):
+        """Insert or replace the record of ``record['url']`` in one of RECORD_TABLES."""
+        self.conn.execute(
+            f"""INSERT INTO {table} VALUES (?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET content_hash = excluded.content_hash, data = excluded.data""",
+            (record['url'], record.get('content_hash'), json.dumps(record))
+        )
+
+    def writer(self, table):
+        """Return a RecordWriter-like writer into one of RECORD_TABLES."""
+        return TableWriter(self, table)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    # Legacy files
+
+    def export(self, name, filename=None):
+        """Write one of EXPORTS to its legacy file; return the path and the record count."""
+        default, method = EXPORTS[name]
+        filename = filename or default
+        return filename, write_records(getattr(self, method)(), filename)
+
+    def import_files(self, pages_file=None, anchors_file=None, **record_files):
+        """Load legacy files into the store, e.g. to start from the output of an earlier run."""
+        counts = {}
+        if pages_file:
+            self.begin_crawl()
+            counts["pages"] = 0
+            for record in read_records(pages_file):
+                self.put_page(record)
+                counts["pages"] += 1
+        if anchors_file:
+            # output2 does not say which page an anchor is on; the next crawl replaces these
+            self.put_anchors("", read_records(anchors_file))
+            counts["anchors"] = self.conn.execute("SELECT COUNT(*) FROM anchors WHERE source = ''").fetchone()[0]
+        hashes = self.content_hashes()
+        for table, filename in record_files.items():
+            if filename:
+                count = 0
+                for record in read_records(filename):
+                    # Files written before fingerprints were stored match the current content
+                    record.setdefault('content_hash', hashes.get(record['url']))
+                    self.put(table, record)
+                    count += 1
+                counts[table] = count
+        self.drop_orphans()
+        self.conn.commit()
+        return counts
+
+    def report(self):
+        """Print the number of rows in every table."""
+        tables = ("pages", "anchors") + RECORD_TABLES
+        counts = [self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables]
+        print(f"Page store {self.path}: " + ", ".join(f"{count} {table}" for table, count in zip(tables, counts)))
+
+def read_pages(source):
+    """Yield the page records of a content file or of a PageStore."""
+    if isinstance(source, PageStore):
+        return source.pages()
+    return read_records(source)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the page store to the legacy JSON files, or import them.")
+    parser.add_argument("command", choices=["export", "import", "stats"])
+    parser.add_argument("names", nargs="*", help=f"Files to export (default: all of {', '.join(EXPORTS)})")
+    parser.add_argument("--store", default="pages.sqlite", help="Path of the page store")
+    parser.add_argument("--output-dir", default=".", help="Directory the exported files are written to")
+    args = parser.parse_args()
+
+    store = PageStore(args.store)
+    if args.command == "export":
+        for name in args.names or EXPORTS:
+            if name not in EXPORTS:
+                parser.error(f"unknown export {name}; choose from {', '.join(EXPORTS)}")
+            filename, count = store.export(name, os.path.join(args.output_dir, EXPORTS[name][0]))
+            print(f"Exported {count} records to {filename}")
+    elif args.command == "import":
+        def existing(name):
+            """Return the path of a legacy file if it exists."""
+            path = os.path.join(args.output_dir, EXPORTS[name][0])
+            return path if os.path.exists(path) else None
+
+        counts = store.import_files(existing("output1"), existing("output2"), questions=existing("questions"),
+                                    links=existing("links"), evaluations=existing("evaluations"))
+        print("Imported " + ", ".join(f"{count} {table}" for table, count in counts.items()))
+    store.report()
+    store.close()
@@ -1,17 +1,46 @@
+import argparse
+import asyncio
 import os
-import json
 from dotenv import load_dotenv
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import LLMChain
-from langchain.callbacks import get_openai_callback
 from langchain.prompts import PromptTemplate
+from records import read_records, RecordWriter
+from dedupe import ClusterFanOut, load_duplicates
+from llm_cache import enable_llm_cache
+from llm_dispatcher import LLMDispatcher, estimate_tokens
+from chunker import first_chunk, tiktoken_tokenizer
+from incremental import page_hash, load_previous, ChangeCounter
+from page_store import PageStore
+
+parser = argparse.ArgumentParser(description="Generate 10 questions per crawled page.")
+parser.add_argument("--input", default="final_output.jsonl", help="Crawled content file")
+parser.add_argument("--output", default="generated_questions1.jsonl", help="Questions file")
+parser.add_argument("--workers", type=int, default=8, help="LLM calls in flight at once")
+parser.add_argument("--rpm", type=int, default=3500, help="Requests per minute allowed by the API")
+parser.add_argument("--tpm", type=int, default=90000, help="Tokens per minute allowed by the API")
+parser.add_argument("--max-retries", type=int, default=6, help="Retries on 429, 5xx and connection errors")
+parser.add_argument("--max-input-tokens", type=int, default=3000,
+                    help="Longest page prefix sent to the model, cut at a sentence boundary")
+parser.add_argument("--full", action="store_true",
+                    help="Regenerate every page instead of only new or changed ones")
+parser.add_argument("--api-base", default=os.getenv("OPENAI_API_BASE"),
+                    help="Chat completions base URL, e.g. a local stub server")
+parser.add_argument("--store", help="Read pages from and save questions to this page store instead of files")
+args = parser.parse_args()
 
 # Load environment variables from a .env file
 load_dotenv()
 
+llm_cache = enable_llm_cache()
+
 # Retrieve the API key
 KEY = os.getenv("OPENAI_KEY")
-llm = ChatOpenAI(openai_api_key=KEY, model_name="gpt-3.5-turbo", temperature=0.5)
+llm = ChatOpenAI(openai_api_key=KEY, model_name="gpt-3.5-turbo", temperature=0.5, max_retries=0,
+                 openai_api_base=args.api_base)
+
+# Pages are cut to fit gpt-3.5's context alongside the prompt and the answer
+tokenizer = tiktoken_tokenizer("gpt-3.5-turbo")
 
 # Define the template for generating questions
 Template = """
@@ -28,35 +57,58 @@ prompt1 = PromptTemplate(
 # Define the chain for generating questions
 quiz_chain = LLMChain(llm=llm, prompt=prompt1, output_key="quiz", verbose=True)
 
-# Read the JSON file with URLs and content
-input_json_path = "final_output.json"
-with open(input_json_path, 'r') as file:
-    data = json.load(file)
+dispatcher = LLMDispatcher(workers=args.workers, rpm=args.rpm, tpm=args.tpm, max_retries=args.max_retries)
 
-# Initialize a list to store the final output
-output_data = []
-
-# Process each entry in the JSON file
-for entry in data:
-    url = entry.get("url", "")
-    content = entry.get("content", "")
+async def questions_for(entry):
+    """Generate questions for one entry's content."""
+    content = first_chunk(entry.get("content", ""), args.max_input_tokens, tokenizer)
 
     # Generate questions for the content
-    with get_openai_callback() as cb:
-        response = quiz_chain.run({"text": content})
+    response = await dispatcher.call(lambda: quiz_chain.arun({"text": content}),
+                                     estimate_tokens(Template + content))
 
     # Parse the generated questions
-    questions = response.strip().split('\n')[:10]  # Split the response into questions
+    return response.strip().split('\n')[:10]  # Split the response into questions
+
+async def questions_or_previous(entry):
+    """Reuse the previous run's questions for an unchanged page, otherwise generate them."""
+    url = entry.get("url", "")
+    previous_entry = previous.get(url)
+    if previous_entry is not None and previous_entry.get("content_hash") == page_hash(entry.get("content", "")):
+        changes.count(url, reused=True)
+        return previous_entry["questions"]
+    changes.count(url, reused=False)
+    return await fan_out.agenerate(entry, questions_for)
+
+async def generate_questions(data, writer):
+    """Write the questions for each entry in input order, generating them only for new or changed pages."""
+    with writer:
+        async for entry, questions in dispatcher.run(data, questions_or_previous):
+            # Add the URL, the fingerprint of the content they came from and the questions to the output
+            writer.write({
+                "url": entry.get("url", ""),
+                "content_hash": page_hash(entry.get("content", "")),
+                "questions": questions
+            })
+
+fan_out = ClusterFanOut(load_duplicates("duplicates.json"))
 
-    # Add the URL and generated questions to the output list
-    output_data.append({
-        "url": url,
-        "questions": questions
-    })
+# Questions of the previous run, keyed by URL; pages no longer crawled are simply not written again
+if args.store:
+    # The store holds the previous questions already, and drops those of deleted pages after each crawl
+    store = PageStore(args.store)
+    data, writer = store.pages(), store.writer("questions")
+    previous = {} if args.full else store.table("questions")
+else:
+    previous = {} if args.full else load_previous(args.output)  # Read before the writer truncates the file
+    data, writer = read_records(args.input), RecordWriter(args.output)
+changes = ChangeCounter(previous)
 
-# Save the final output to a new JSON file
-output_json_path = "generated_questions1.json"
-with open(output_json_path, 'w') as outfile:
-    json.dump(output_data, outfile, indent=4)
+# Stream the entries through the chain into the output file
+asyncio.run(generate_questions(data, writer))
+changes.report("questions")
+dispatcher.report()
+fan_out.report()
+llm_cache.report()
 
-print(f"Questions generated and saved to {output_json_path}")
+print(f"Questions generated and saved to {args.store or args.output}")
@@ -0,0 +1,88 @@
+import json
+
+_INCOMPLETE = object()
+
+def _iter_json_array(f, chunk_size=1 << 16):
+    """Yield the items of a JSON array from a file object without loading it all at once."""
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()[1:]  # Drop the opening bracket
+    eof = False
+    while True:
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+        if buffer.startswith("]"):
+            return
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                item = _INCOMPLETE
+            # An item ending exactly at the buffer edge may be a truncated number
+            if item is not _INCOMPLETE and (end < len(buffer) or eof):
+                yield item
+                buffer = buffer[end:]
+                continue
+        if eof:
+            raise ValueError(f"Truncated JSON array in {f.name}")
+        chunk = f.read(max(chunk_size, len(buffer)))  # Grow geometrically for large items
+        eof = not chunk
+        buffer += chunk
+
+def read_records(filename):
+    """Yield the records of a JSONL file or a legacy JSON array file, one at a time."""
+    with open(filename, 'r') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if not first:
+            return
+        f.seek(0)
+        if first == "[":
+            yield from _iter_json_array(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+class RecordWriter:
+    """Write records to disk one at a time as they are produced.
+
+    Paths ending in ``.jsonl`` get one JSON object per line; any other path
+    gets a JSON array formatted exactly like ``json.dump(data, f, indent=4)``.
+    Each record is flushed as soon as it is written.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lines = filename.endswith(".jsonl")
+        self.count = 0
+        self.file = open(filename, 'w')
+
+    def write(self, record):
+        """Append one record."""
+        if self.lines:
+            self.file.write(json.dumps(record) + "\n")
+        else:
+            item = json.dumps(record, indent=4).replace("\n", "\n    ")
+            self.file.write(("[\n    " if self.count == 0 else ",\n    ") + item)
+        self.count += 1
+        self.file.flush()
+
+    def close(self):
+        """Finish the file."""
+        if not self.lines:
+            self.file.write("[]" if self.count == 0 else "\n]")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_records(records, filename):
+    """Write an iterable of records to a file, streaming them one at a time; return the count."""
+    with RecordWriter(filename) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
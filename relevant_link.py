@@ -1,68 +1,227 @@
-import json
+import argparse
+import hashlib
+import os
+import pickle
+from itertools import islice
+
+import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from records import read_records, write_records
+from incremental import page_hash, load_previous, ChangeCounter
+from page_store import PageStore, read_pages
+
+def corpus_fingerprint(content_file):
+    """Hash the URLs and contents of the corpus to tell whether a saved index is still valid."""
+    digest = hashlib.sha256()
+    for entry in read_pages(content_file):
+        if entry['content']:
+            digest.update(entry['url'].encode('utf-8') + b'\0' + entry['content'].encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+def build_index(content_file):
+    """Fit a TF-IDF vectorizer on the whole content corpus once.
 
-def load_json(filename):
-    """Load JSON data from a file."""
-    with open(filename, 'r') as f:
-        return json.load(f)
+    Pages with empty content are skipped. Returns a dict holding the fitted
+    vectorizer, the L2-normalized sparse document matrix and the URL, title
+    and content fingerprint of each row.
+    """
+    urls, titles, hashes = [], [], []
+
+    def documents():
+        """Yield the non-empty page contents, recording each row's URL and title."""
+        for entry in read_pages(content_file):
+            if entry['content']:  # Skip empty content
+                urls.append(entry['url'])
+                titles.append(entry.get('title', 'No Title'))  # Get title or use 'No Title' if missing
+                hashes.append(page_hash(entry['content']))
+                yield entry['content']
 
-def calculate_relevance(questions, content):
-    """Calculate relevance score between questions and content."""
-    questions_text = " ".join(questions) if isinstance(questions, list) else questions
     vectorizer = TfidfVectorizer()
-    vectors = vectorizer.fit_transform([questions_text, content])
-    similarity = cosine_similarity(vectors[0:1], vectors[1:])
-    return similarity[0][0]
-
-def get_top_relevant_links(questions, content_data):
-    """Find the top 5 relevant links for a set of questions based on content."""
-    relevance_scores = []
-    for entry in content_data:
-        url = entry['url']
-        content = entry['content']
-        title = entry.get('title', 'No Title')  # Get title or use 'No Title' if missing
-        if content:  # Skip empty content
-            score = calculate_relevance(questions, content)
-            relevance_scores.append((url, title, score))
-    
-    # Sort links by relevance score in descending order
-    relevance_scores.sort(key=lambda x: x[2], reverse=True)
-    
-    # Get the top 5 links with titles
-    top_links = [{'url': url, 'title': title} for url, title, score in relevance_scores[:5]]
-    return top_links
+    matrix = vectorizer.fit_transform(documents())
+    return {
+        "vectorizer": vectorizer,
+        "matrix": matrix.tocsr(),
+        "urls": urls,
+        "titles": titles,
+        "hashes": hashes,
+        "row_of": {url: row for row, url in enumerate(urls)}
+    }
 
-def main():
-    # Load questions and content data
-    questions_file = 'generated_questions1.json'  # Replace with your questions file
-    content_file = 'final_output.json'  # Replace with your content file
-    
-    questions_data = load_json(questions_file)
-    content_data = load_json(content_file)
-    
+def load_or_build_index(content_file, index_path):
+    """Load the persisted index if the corpus is unchanged, otherwise refit and save it."""
+    fingerprint = corpus_fingerprint(content_file)
+    if index_path and os.path.exists(index_path):
+        with open(index_path, 'rb') as f:
+            index = pickle.load(f)
+        if index.get("fingerprint") == fingerprint and "hashes" in index:
+            print(f"Loaded TF-IDF index from {index_path}")
+            return index
+
+    index = build_index(content_file)
+    index["fingerprint"] = fingerprint
+    if index_path:
+        with open(index_path, 'wb') as f:
+            pickle.dump(index, f)
+        print(f"TF-IDF index saved to {index_path}")
+    return index
+
+def rank_links(index, question_sets, source_urls=None, top_k=5):
+    """Score a batch of question sets against every page with one sparse matrix product.
+
+    Returns the top ``top_k`` links (``{'url', 'title'}``) for each question
+    set, ordered by cosine similarity. If ``source_urls`` is given, each
+    question set's own page is excluded from its links.
+    """
+    texts = [" ".join(questions) if isinstance(questions, list) else questions for questions in question_sets]
+    queries = index["vectorizer"].transform(texts)  # Rows are L2-normalized, so the product is cosine similarity
+    scores = (queries @ index["matrix"].T).toarray()
+
+    k = top_k
+    if source_urls is not None:
+        k += 1  # One candidate may be the excluded source page
+        for i, url in enumerate(source_urls):
+            if url in index["row_of"]:
+                scores[i, index["row_of"][url]] = -np.inf
+
+    k = min(k, scores.shape[1])
     results = []
-    
-    # Process each set of 10 questions
-    for entry in questions_data:
-        url = entry['url']
-        questions = entry['questions']  # Assuming questions are stored as a list
-        
-        # Get top relevant links for this set of questions
-        top_links = get_top_relevant_links(questions, content_data)
-        
-        results.append({
-            'url': url,
-            'questions': questions,  # Include the 10 questions
-            'relevant_links': top_links
-        })
-    
-    # Save results to a new JSON file
-    output_json_path = 'final_output_with_relevant_links.json'
-    with open(output_json_path, 'w') as f:
-        json.dump(results, f, indent=4)
-    
-    print(f"Relevant links saved to {output_json_path}")
+    for row in scores:
+        candidates = np.argpartition(-row, k - 1)[:k] if k else []
+        # Highest score first, ties broken by corpus order
+        best = sorted(candidates, key=lambda col: (-row[col], col))
+        results.append([
+            {'url': index["urls"][col], 'title': index["titles"][col]}
+            for col in best if row[col] != -np.inf
+        ][:top_k])
+    return results
+
+def unaffected_by_changes(index, question_sets, old_links, changed, top_k, source_urls=None):
+    """Tell, per question set, whether the corpus changes leave its previous top-k links as they were.
+
+    ``changed`` holds the rows of new or modified pages. The previous links
+    stand if they all still exist unchanged, there are as many of them as
+    rank_links would return for the corpus, and no changed page scores at
+    least as high as the weakest of them. IDF shifts caused by the changes
+    are too small to reorder unchanged pages and are ignored.
+    """
+    changed_set = set(changed.tolist())
+    queries = index["vectorizer"].transform(
+        [" ".join(questions) if isinstance(questions, list) else questions for questions in question_sets])
+    changed_scores = (queries @ index["matrix"][changed].T).toarray() if len(changed) else None
+    results = []
+    for i, links in enumerate(old_links):
+        rows = [index["row_of"].get(link['url']) for link in links]
+        excluded = source_urls is not None and source_urls[i] in index["row_of"]
+        # Fewer than top_k links only when the corpus has no more pages to offer
+        expected = min(top_k, len(index["urls"]) - excluded)
+        if None in rows or changed_set.intersection(rows) or len(rows) != expected:
+            results.append(False)
+            continue
+        if changed_scores is None or len(rows) < top_k:
+            results.append(True)
+            continue
+        scores = changed_scores[i].copy()
+        if excluded:
+            scores[changed == index["row_of"][source_urls[i]]] = -np.inf
+        weakest = (queries[i] @ index["matrix"][rows].T).toarray().min()
+        results.append(bool(scores.max() < weakest))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the most relevant pages for each set of generated questions.")
+    parser.add_argument("--questions", default='generated_questions1.jsonl', help="Questions file")
+    parser.add_argument("--content", default='final_output.jsonl', help="Content file")
+    parser.add_argument("--output", default='final_output_with_relevant_links.json', help="Output file")
+    parser.add_argument("--method", choices=["tfidf", "hybrid"], default="tfidf",
+                        help="TF-IDF cosine, or BM25 fused with local MiniLM embeddings")
+    parser.add_argument("--index", default='tfidf_index.pkl', help="Where the fitted TF-IDF index is persisted")
+    parser.add_argument("--hybrid-dir", default='embedding_store', help="Shared embedding store used by the hybrid index")
+    parser.add_argument("--embedding-model", default=None, help="Sentence-transformers model name or local path")
+    parser.add_argument("--top-k", type=int, default=5, help="Number of links per page")
+    parser.add_argument("--exclude-self", action="store_true", help="Leave each page out of its own links")
+    parser.add_argument("--batch-size", type=int, default=256, help="Question sets scored per matrix product")
+    parser.add_argument("--full", action="store_true", help="Rank every page again instead of only affected ones")
+    parser.add_argument("--store", help="Read pages and questions from and save links to this page store instead of files")
+    args = parser.parse_args()
+
+    store = PageStore(args.store) if args.store else None
+    content = store or args.content
+
+    if args.method == "hybrid":
+        from retrieval_index import HybridIndex, EMBEDDING_MODEL
+        hybrid = HybridIndex(args.hybrid_dir, args.embedding_model or EMBEDDING_MODEL).build(content)
+        rank = hybrid.rank
+        index = None
+    else:
+        index = load_or_build_index(content, args.index)
+        rank = lambda question_sets, sources, top_k: rank_links(index, question_sets, sources, top_k)
+
+    # Links of the previous run are kept where the corpus changes cannot affect them (TF-IDF only)
+    if args.full or index is None:
+        previous = {}
+    else:
+        previous = store.table("links") if store else load_previous(args.output)
+    changes = ChangeCounter(previous)
+    # Links ranked with other settings are never reused
+    ranking = {'method': args.method, 'top_k': args.top_k, 'exclude_self': args.exclude_self}
+    if previous:
+        previous_hashes = {url: entry.get('content_hash') for url, entry in previous.items()}
+        changed = np.array([row for row, (url, digest) in enumerate(zip(index["urls"], index["hashes"]))
+                            if previous_hashes.get(url) != digest], dtype=np.int64)
+        hash_of = dict(zip(index["urls"], index["hashes"]))
+
+    def results():
+        """Yield the ranked links for each question set, scoring them in batches."""
+        entries = store.questions() if store else read_records(args.questions)
+        while True:
+            batch = list(islice(entries, args.batch_size))
+            if not batch:
+                break
+            sources = [entry['url'] for entry in batch] if args.exclude_self else None
+            top_links = [None] * len(batch)
+            if previous:
+                # Candidates for reuse: same questions from the same content as last time
+                candidates = [i for i, entry in enumerate(batch)
+                              if entry['url'] in previous
+                              and previous[entry['url']]['questions'] == entry['questions']
+                              and previous[entry['url']].get('content_hash') == hash_of.get(entry['url'])
+                              and previous[entry['url']].get('ranking') == ranking]
+                if candidates:
+                    keep = unaffected_by_changes(
+                        index, [batch[i]['questions'] for i in candidates],
+                        [previous[batch[i]['url']]['relevant_links'] for i in candidates], changed, args.top_k,
+                        [sources[i] for i in candidates] if sources else None)
+                    for i, unaffected in zip(candidates, keep):
+                        if unaffected:
+                            top_links[i] = previous[batch[i]['url']]['relevant_links']
+            stale = [i for i, links in enumerate(top_links) if links is None]
+            if stale:
+                ranked = rank([batch[i]['questions'] for i in stale],
+                              [sources[i] for i in stale] if sources else None, args.top_k)
+                for i, links in zip(stale, ranked):
+                    top_links[i] = links
+            for i, (entry, links) in enumerate(zip(batch, top_links)):
+                changes.count(entry['url'], reused=i not in stale)
+                yield {
+                    'url': entry['url'],
+                    'content_hash': entry.get('content_hash'),  # Fingerprint of the page the questions came from
+                    'questions': entry['questions'],  # Include the 10 questions
+                    'relevant_links': links,
+                    'ranking': ranking  # Settings the links were ranked with
+                }
+
+    if store:
+        with store.writer("links") as writer:
+            for record in results():
+                writer.write(record)
+    else:
+        # Save results to a new JSON file
+        write_records(results(), args.output)
+    changes.report("links")
+    if args.method == "hybrid":
+        hybrid.store.save()  # Keep the query embeddings for the next run
+
+    print(f"Relevant links saved to {args.store or args.output}")
 
 if __name__ == "__main__":
     main()
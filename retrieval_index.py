@@ -0,0 +1,112 @@
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from page_store import read_pages
+from embedding_store import EmbeddingStore, EMBEDDING_MODEL
+
+class HybridIndex:
+    """Local page index combining BM25 over terms with dense MiniLM embeddings.
+
+    Lexical scores come from a BM25-weighted sparse term matrix; dense scores
+    are cosine similarities against page embeddings kept in the shared
+    EmbeddingStore, so unchanged pages are never embedded again. Above
+    ``ann_threshold`` pages the dense side searches an inverted-file index
+    (k-means cells, probing the ``nprobe`` nearest) instead of every page.
+    The two rankings are combined with reciprocal rank fusion. Everything
+    runs offline; ``model_name`` may be a local path.
+    """
+
+    def __init__(self, directory="embedding_store", model_name=EMBEDDING_MODEL, ann_threshold=5000, nprobe=8,
+                 k1=1.5, b=0.75):
+        self.directory = directory
+        self.model_name = model_name
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self.k1 = k1
+        self.b = b
+        self.store = EmbeddingStore(directory, model_name)
+
+    def build(self, content_file):
+        """Index the non-empty pages of a content file or PageStore, embedding only new or changed pages."""
+        self.urls, self.titles = [], []
+        hashes = []
+
+        def documents():
+            """Yield page contents for BM25 while queueing them for embedding."""
+            for entry in read_pages(content_file):
+                content = entry['content']
+                if not content:  # Skip empty content
+                    continue
+                self.urls.append(entry['url'])
+                self.titles.append(entry.get('title', 'No Title'))
+                hashes.extend(self.store.add([content]))
+                yield content
+
+        encoded = self.store.encoded
+        self.vectorizer = CountVectorizer()
+        counts = self.vectorizer.fit_transform(documents()).tocsr().astype(np.float32)
+        self.rows = self.store.rows(hashes)
+        self.store.save()
+        # The store also holds other corpora's pages and past queries; only this corpus is searched
+        self.page_vectors = self.store.matrix[self.rows]
+        embedded = self.store.encoded - encoded
+        print(f"Hybrid index: {len(self.urls)} pages, {embedded} embedded, {len(self.urls) - embedded} reused")
+
+        # BM25 weight of every (page, term) pair, so scoring a query is one sparse product
+        n = counts.shape[0]
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        norms = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1))
+        tf = counts.data
+        row_norms = np.repeat(norms, np.diff(counts.indptr))
+        counts.data = self.idf[counts.indices] * tf * (self.k1 + 1) / (tf + row_norms)
+        self.bm25 = counts
+
+        self.row_of = {url: i for i, url in enumerate(self.urls)}
+        self.cells = None
+        if len(self.urls) > self.ann_threshold:
+            self._build_ann()
+        return self
+
+    def _build_ann(self):
+        """Cluster the page embeddings into inverted-file cells for approximate search."""
+        from sklearn.cluster import MiniBatchKMeans
+        kmeans = MiniBatchKMeans(n_clusters=int(np.sqrt(len(self.urls))), n_init=3, random_state=0).fit(self.page_vectors)
+        self.centroids = kmeans.cluster_centers_.astype(np.float32)
+        self.cells = [np.flatnonzero(kmeans.labels_ == cell) for cell in range(len(self.centroids))]
+
+    def _dense_candidates(self, queries, depth):
+        """Return the page indices of the best dense matches for each query, best first."""
+        if self.cells is None:
+            scores = queries @ self.page_vectors.T
+            return [np.argsort(-row, kind='stable')[:depth] for row in scores]
+        candidates = []
+        for query in queries:
+            probe = np.argsort(-(self.centroids @ query))[:self.nprobe]
+            pages = np.concatenate([self.cells[cell] for cell in probe])
+            scores = self.page_vectors[pages] @ query
+            candidates.append(pages[np.argsort(-scores, kind='stable')[:depth]])
+        return candidates
+
+    def rank(self, question_sets, source_urls=None, top_k=5, depth=50, rrf_k=60):
+        """Return the top ``top_k`` links for each question set, fusing BM25 and dense rankings."""
+        texts = [" ".join(questions) if isinstance(questions, list) else questions for questions in question_sets]
+        lexical = (self.vectorizer.transform(texts) > 0).astype(np.float32) @ self.bm25.T
+        lexical = lexical.toarray()
+        dense = self._dense_candidates(self.store.embed(texts), depth)
+
+        results = []
+        for i in range(len(texts)):
+            fused = {}
+            lexical_pages = np.argsort(-lexical[i], kind='stable')[:depth]
+            for rank, page in enumerate(lexical_pages):
+                if lexical[i, page] > 0:
+                    fused[page] = fused.get(page, 0.0) + 1.0 / (rrf_k + rank + 1)
+            for rank, page in enumerate(dense[i]):
+                fused[page] = fused.get(page, 0.0) + 1.0 / (rrf_k + rank + 1)
+
+            if source_urls is not None:
+                fused.pop(self.row_of.get(source_urls[i]), None)
+            best = sorted(fused, key=lambda page: (-fused[page], page))[:top_k]
+            results.append([{'url': self.urls[page], 'title': self.titles[page]} for page in best])
+        return results
@@ -4,6 +4,8 @@ import traceback
 import pandas as pd
 from dotenv import load_dotenv
 from mcqgenrator.logger import logging
+from llm_cache import enable_llm_cache
+from chunker import first_chunk, tiktoken_tokenizer
 
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
@@ -13,7 +15,17 @@ from langchain.chains import SequentialChain
 load_dotenv()
 key = os.getenv("OPENAI_API_KEY")
 
+llm_cache = enable_llm_cache()
+
 llm = ChatOpenAI(openai_api_key = key , model_name = 'gpt-3.5-turbo', temperature = 0.3)
+
+# Uploaded text is cut at a sentence boundary so the prompt and the quiz fit gpt-3.5's context
+MAX_TEXT_TOKENS = 2500
+tokenizer = tiktoken_tokenizer('gpt-3.5-turbo')
+
+def fit_text(text, max_tokens = MAX_TEXT_TOKENS):
+    return first_chunk(text, max_tokens, tokenizer)
+
 Template = """
 Text : {text}
 you are an expert MCQ maker. Given the above text, it is your job to \